@@ -11,8 +11,9 @@
 #				modules, and custom python scripts.
 
 
-import os, sys, time, arcpy
+import os, sys, time, multiprocessing, arcpy
 from time import strftime
+from util import segment_table as sT
 from util.segment import seg_network as seg
 from util.flv import elevation_slope as eS
 from util.drainage import raster_prep as rP
@@ -20,20 +21,9 @@ from util.drainage import drainage as dR
 from util.drainage import bf_ss_calc as bF
 from util.drainage import calc_relative as cR
 
-arcpy.CheckOutExtension("Spatial")
-arcpy.CheckOutExtension("3D")
-arcpy.env.overwriteOutput = True
-
-# start processing time
-startTime = time.time()
-printTime = strftime("%a, %d %b %Y %H:%M:%S")
-arcpy.AddMessage("Processing started at " + str(printTime))
-arcpy.AddMessage("-------------------------------------")
-
 # user-supplied input variables
 ####outFGB = arcpy.GetParameterAsText(0)
 outFGB = r"C:\JL\Testing\ncc-tool\Methow_HUC6\test_20160530.gdb"
-arcpy.env.workspace = outFGB
 ####hucPoly = arcpy.GetParameterAsText(1)
 hucPoly = r"C:\JL\Testing\ncc-tool\Methow_HUC6\data\huc6.shp"
 ####hydroLine = arcpy.GetParameterAsText(2)
@@ -47,37 +37,65 @@ inPPT = r"C:\JL\Testing\ncc-tool\Methow_HUC6\data\ppt_buf2km.tif"
 index_bool = "true"
 strm_index = "GNIS_ID"
 boolPnt = "true"
+# number of flowlines to segment at a time (None segments the whole network in memory)
+chunkSize = None
+# size (cells per side) of the raster tiles, and the number of worker processes they are spread over
+tileSize = 2048
+processes = max(multiprocessing.cpu_count() - 1, 1)
+
+
+# the workflow runs under the __main__ guard: the worker processes of the tiled raster steps start
+# by importing this script (on Windows), and must not run the workflow again
+def main():
+	arcpy.CheckOutExtension("Spatial")
+	arcpy.env.overwriteOutput = True
+	arcpy.env.workspace = outFGB
+
+	# start processing time
+	startTime = time.time()
+	printTime = strftime("%a, %d %b %Y %H:%M:%S")
+	arcpy.AddMessage("Processing started at " + str(printTime))
+	arcpy.AddMessage("-------------------------------------")
+
+	# Prepare vector data for workflow
+	segEndpoints, cleanStream = seg.main(hucPoly, hydroLine, index_bool, strm_index, segLen, outFGB, boolPnt, chunkSize)
+
+	# Prepare raster data for workflow
+	flowDir, flowAcc, ppt, demFill, faWt =  rP.raster_prep(inDEM, hucPoly, inPPT, outFGB, tileSize, processes)
+
+	# Read the segments into memory once: each calculation below adds its results to the segment table
+	# as columns, and the table is written to the geodatabase at the end
+	segTable = sT.SegmentTable.read(cleanStream)
+
+	# Calculate drainage area and precipitation per segment (the weighted flow accumulation was
+	# calculated with the unweighted flow accumulation in raster_prep)
+	dR.drain_table(segTable, segEndpoints, flowDir, flowAcc, ppt, outFGB, faWt)
 
-# Prepare vector data for workflow
-segEndpoints, cleanStream = seg.main(hucPoly, hydroLine, index_bool, strm_index, segLen, outFGB, boolPnt)
+	# Calculate slope (adapted from the Fluvial Corridor ElevationSlope.py tool)
+	arcpy.AddMessage("Calculating slope per line segment...")
+	eS.elev_slope_table(segTable, demFill)
 
-# Prepare raster data for workflow
-flowDir, flowAcc, ppt, demFill =  rP.raster_prep(inDEM, hucPoly, inPPT, outFGB)
+	# Calculate bankfull flow values and shear stress
+	bF.hydraulic_table(segTable, flowAcc)
 
-# Calculate weighted flow accumulation (i.e. precipitation)
-wtCalc_lin = dR.drain_calc(inDEM, segEndpoints, cleanStream, flowDir, flowAcc, ppt, outFGB)
+	# Calculate relative shear stress, slope and bankfull width
+	cR.relative_table(segTable, ["ss", "Slope", "bfw_m"])
 
-# Calculate slope (using the Fluvial Corridor ElevationSlope.py tool)
-arcpy.AddMessage("Calculating slope per line segment...")
-slopeOut = eS.elev_slope(wtCalc_lin, demFill, outFGB + "\\seg_final")
+	# Write the segments with all of their parameters
+	arcpy.AddMessage("Writing the stream segments and parameters...")
+	segOut = segTable.write(outFGB + "\\seg_final")
 
-# Calculate bankfull flow values and shear stress
-bfwOut = bF.bfw_calc(slopeOut, outFGB)
-bfdOut = bF.bfd_calc(bfwOut, outFGB)
-ssOut = bF.ss_calc(bfdOut, outFGB)
-fpdOut = bF.fpd_calc(ssOut, outFGB)
+	# Check in ESRI extensions
+	arcpy.CheckInExtension("Spatial")
 
-# Calculate relative shear stress
-rssOut = cR.main(fpdOut, "ss", outFGB)
+	# end processing time
+	printTime = strftime("%a, %d %b %Y %H:%M:%S")
+	arcpy.AddMessage("-------------------------------------")
+	arcpy.AddMessage("Processing complete at " + str(printTime))
+	curTime = time.time()
+	totalTime = curTime - startTime
+	arcpy.AddMessage("Total processing time was " + str(totalTime) + " seconds.")
 
-# Check in ESRI extensions
-arcpy.CheckInExtension("Spatial")
-arcpy.CheckInExtension("3D")
 
-# end processing time
-printTime = strftime("%a, %d %b %Y %H:%M:%S")
-arcpy.AddMessage("-------------------------------------")
-arcpy.AddMessage("Processing complete at " + str(printTime))
-curTime = time.time()
-totalTime = curTime - startTime
-arcpy.AddMessage("Total processing time was " + str(totalTime) + " seconds.")
\ No newline at end of file
+if __name__ == "__main__":
+	main()
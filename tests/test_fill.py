@@ -0,0 +1,96 @@
+# file name:	test_fill.py
+# description:	Checks of the priority-flood depression fill (util/drainage/fill.py) against a brute
+#				force fill that lowers a water surface until no cell can drain any further, and of the
+#				tiled fill against the in-memory one.
+# author:		Jesse Langdon
+# dependencies: numpy (ESRI arcpy module through raster_tile.py)
+
+import os, shutil, tempfile, unittest
+import numpy as np
+from util.drainage import fill as pF
+
+
+# brute force fill: start with every interior cell at +inf and lower each cell to the highest of its
+# own elevation and its lowest neighbour, until nothing changes. Edge cells (next to NoData or the
+# border) keep their elevation.
+def brute_force_fill(dem):
+    nrows, ncols = dem.shape
+    pad = np.empty((nrows + 2, ncols + 2))
+    pad[...] = np.nan
+    pad[1:-1, 1:-1] = dem
+    data = ~np.isnan(pad)
+    edge = np.zeros(pad.shape, dtype=bool)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            edge[1:-1, 1:-1] |= ~data[1 + dy:nrows + 1 + dy, 1 + dx:ncols + 1 + dx]
+    edge &= data
+    water = np.where(edge, pad, np.inf)
+    water[~data] = np.nan
+    while True:
+        low = np.empty(pad.shape)
+        low[...] = np.inf
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                if dy or dx:
+                    nb = water[1 + dy:nrows + 1 + dy, 1 + dx:ncols + 1 + dx]
+                    low[1:-1, 1:-1] = np.fmin(low[1:-1, 1:-1], nb)
+        new = np.where(edge | ~data, water, np.maximum(pad, np.minimum(water, low)))
+        if np.array_equal(np.nan_to_num(new), np.nan_to_num(water)):
+            return new[1:-1, 1:-1]
+        water = new
+
+
+class FillTest(unittest.TestCase):
+
+    def test_matches_brute_force(self):
+        rng = np.random.RandomState(4)
+        for nrows, ncols in [(1, 1), (5, 7), (30, 40)]:
+            dem = rng.rand(nrows, ncols) * 10
+            dem[rng.rand(nrows, ncols) < 0.05] = np.nan
+            np.testing.assert_array_equal(pF.fill(dem), brute_force_fill(dem))
+
+    def test_epsilon_drains_every_cell(self):
+        # with epsilon, every filled cell is above the cell it drains through, so no flats are left
+        rng = np.random.RandomState(5)
+        dem = rng.rand(30, 40) * 10
+        filled = pF.fill(dem, 1e-3)
+        self.assertTrue(np.all(filled >= dem))
+        interior = filled[1:-1, 1:-1]
+        lower = np.zeros(interior.shape, dtype=bool)
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                if dy or dx:
+                    lower |= filled[1 + dy:29 + dy, 1 + dx:39 + dx] < interior
+        self.assertTrue(np.all(lower))
+
+    def test_keeps_dtype_and_nodata(self):
+        dem = np.array([[3, 3, 3], [3, 1, np.nan], [3, 3, 3]], dtype=np.float32)
+        filled = pF.fill(dem)
+        self.assertEqual(filled.dtype, np.float32)
+        self.assertTrue(np.isnan(filled[1, 2]))
+
+
+class TiledFillTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+    def test_matches_fill(self):
+        rng = np.random.RandomState(8)
+        dem_path = os.path.join(self.scratch, "dem.npy")
+        out_path = os.path.join(self.scratch, "fill.npy")
+        for nrows, ncols in [(1, 9), (17, 23), (40, 35)]:
+            # a slope across the tiles, so that depressions drain through several of them
+            dem = rng.rand(nrows, ncols) * 10 + np.arange(ncols)[np.newaxis, :] * 0.2
+            dem[rng.rand(nrows, ncols) < 0.05] = np.nan
+            np.save(dem_path, dem)
+            for tile_size, processes in [(3, 1), (8, 2), (64, 1)]:
+                pF.fill_tiled(dem_path, out_path, tile_size, processes)
+                np.testing.assert_array_equal(np.load(out_path), pF.fill(dem))
+
+
+if __name__ == "__main__":
+    unittest.main()
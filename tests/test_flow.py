@@ -0,0 +1,76 @@
+# file name:	test_flow.py
+# description:	Checks of the NumPy flow direction and accumulation kernels (util/drainage/flow.py)
+#				against brute force, and of the tiled accumulation against the serial one.  Run with
+#				the ArcGIS python interpreter from the repository root:
+#				python -m unittest discover tests
+# author:		Jesse Langdon
+# dependencies: numpy (ESRI arcpy module through raster_tile.py)
+
+import os, shutil, tempfile, unittest
+import numpy as np
+from util.drainage import fill as pF
+from util.drainage import flow as fW
+
+
+# a filled random DEM with a gentle slope to the east and a few NoData cells
+def random_dem(nrows, ncols, seed):
+    rng = np.random.RandomState(seed)
+    dem = rng.rand(nrows, ncols) * 10 + np.arange(ncols)[np.newaxis, :] * 0.1
+    dem[rng.rand(nrows, ncols) < 0.02] = np.nan
+    return pF.fill(dem, 1e-4)
+
+
+# accumulation by walking the flow path of every cell and adding its weight to every cell below it
+def brute_force_accumulation(fdir, weight):
+    down = fW.downstream(fdir)
+    acc = np.zeros(fdir.size)
+    w = np.nan_to_num(weight.ravel())
+    for cell in np.flatnonzero(fdir.ravel() > 0):
+        nxt = down[cell]
+        while nxt >= 0:
+            acc[nxt] += w[cell]
+            nxt = down[nxt]
+    acc[fdir.ravel() == 0] = np.nan
+    return acc.reshape(fdir.shape)
+
+
+class AccumulationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fdir = fW.d8_direction(random_dem(37, 53, 1))
+        self.ppt = np.random.RandomState(2).rand(37, 53)
+        self.scratch = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+    def test_filled_dem_drains(self):
+        # every cell with data gets a direction once the DEM is filled
+        dem = random_dem(37, 53, 1)
+        self.assertTrue(np.all(self.fdir[~np.isnan(dem)] > 0))
+
+    def test_accumulate_matches_brute_force(self):
+        fa, fa_wt = fW.accumulate(self.fdir, [None, self.ppt])
+        np.testing.assert_array_equal(fa, brute_force_accumulation(self.fdir, np.ones(self.fdir.shape)))
+        np.testing.assert_allclose(fa_wt, brute_force_accumulation(self.fdir, self.ppt), rtol=1e-12)
+
+    def run_tiled(self, tile_size, processes):
+        fd_path = os.path.join(self.scratch, "fd.npy")
+        ppt_path = os.path.join(self.scratch, "ppt.npy")
+        np.save(fd_path, self.fdir)
+        np.save(ppt_path, self.ppt)
+        out = [os.path.join(self.scratch, "fa.npy"), os.path.join(self.scratch, "fa_wt.npy")]
+        fW.accumulate_tiled(fd_path, [None, ppt_path], out, tile_size, processes, self.scratch)
+        return [np.load(path) for path in out]
+
+    def test_tiled_matches_serial(self):
+        fa, fa_wt = fW.accumulate(self.fdir, [None, self.ppt])
+        for tile_size, processes in [(7, 1), (16, 1), (10, 2), (64, 1)]:
+            tiled_fa, tiled_wt = self.run_tiled(tile_size, processes)
+            # the tiled results are float32, as written to the rasters
+            np.testing.assert_array_equal(tiled_fa, fa.astype(np.float32))
+            np.testing.assert_allclose(tiled_wt, fa_wt.astype(np.float32), rtol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
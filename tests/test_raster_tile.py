@@ -0,0 +1,55 @@
+# file name:	test_raster_tile.py
+# description:	Checks of the block operations of the tiled raster engine (util/drainage/raster_tile.py):
+#				the circular focal mean against a brute force mean over each neighbourhood.
+# author:		Jesse Langdon
+# dependencies: numpy (ESRI arcpy module through raster_tile.py)
+
+import unittest
+import numpy as np
+from util.drainage import raster_tile as rT
+
+
+# mean of the cells with data whose centres are within radius cells of each cell, or NaN
+def brute_force_mean(values, radius):
+    nrows, ncols = values.shape
+    r = int(radius)
+    out = np.empty(values.shape)
+    out[...] = np.nan
+    for i in range(nrows):
+        for j in range(ncols):
+            cells = [values[i + dy, j + dx] for dy in range(-r, r + 1) for dx in range(-r, r + 1)
+                     if dy * dy + dx * dx <= radius * radius and 0 <= i + dy < nrows and 0 <= j + dx < ncols]
+            cells = [v for v in cells if not np.isnan(v)]
+            if cells:
+                out[i, j] = np.mean(cells)
+    return out
+
+
+class FocalMeanTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(7)
+        self.values = rng.rand(23, 31) * 100
+        self.values[rng.rand(23, 31) < 0.3] = np.nan
+        # a block of NoData larger than the neighbourhood, as outside the HUC mask
+        self.values[5:15, 10:22] = np.nan
+
+    def test_matches_brute_force(self):
+        for radius in [1, 2, 3.5, 5]:
+            np.testing.assert_allclose(rT.focal_mean_circle(self.values, radius),
+                                       brute_force_mean(self.values, radius), rtol=1e-9)
+
+    def test_circle_spans(self):
+        # NbrCircle(1, "CELL") is the centre cell and its four edge neighbours
+        self.assertEqual(rT.circle_spans(1), [(-1, 0), (0, 1), (1, 0)])
+
+    def test_masked_focal_mean(self):
+        mask = np.ones(self.values.shape, dtype=bool)
+        mask[:, :8] = False
+        masked = np.where(mask, self.values, np.nan)
+        np.testing.assert_allclose(rT.masked_focal_mean(self.values, mask, 3), brute_force_mean(masked, 3),
+                                   rtol=1e-9)
+
+
+if __name__ == "__main__":
+    unittest.main()
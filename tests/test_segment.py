@@ -0,0 +1,99 @@
+# file name:	test_segment.py
+# description:	Checks of the flat line array kernels used to segment the stream network:
+#				split_line.split_lines and topology.merge_lines, point_nodes and break_cycles.
+# author:		Jesse Langdon
+# dependencies: numpy (ESRI arcpy module through line_array.py)
+
+import unittest
+import numpy as np
+from util import line_array
+from util.segment import split_line, topology
+
+
+class SplitLinesTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(6)
+        parts = [np.cumsum(rng.rand(n, 2) * 40, axis=0) for n in (2, 5, 9, 3)]
+        parts.append(np.array([[5.0, 5.0], [5.0, 5.0]]))
+        self.xy = np.concatenate(parts)
+        self.offsets = np.concatenate(([0], np.cumsum([len(p) for p in parts])))
+        self.length = line_array.line_length(self.xy, self.offsets)
+
+    def test_pieces_cover_each_line(self):
+        seg_xy, seg_offsets, line_idx, from_m, to_m = split_line.split_lines(self.xy, self.offsets, 25.0)
+        seg_length = line_array.line_length(seg_xy, seg_offsets)
+        np.testing.assert_allclose(seg_length, to_m - from_m, atol=1e-9)
+        # every piece is the segment length except the last of each line, and the pieces add up
+        last = np.concatenate((line_idx[1:] != line_idx[:-1], [True]))
+        np.testing.assert_allclose(seg_length[~last], 25.0)
+        self.assertTrue(np.all(seg_length[last] <= 25.0 + 1e-9))
+        np.testing.assert_allclose(np.bincount(line_idx, seg_length, len(self.length))[:-1], self.length[:-1])
+        # the zero-length line gives no pieces
+        self.assertNotIn(len(self.length) - 1, line_idx)
+
+    def test_pieces_join_end_to_end(self):
+        seg_xy, seg_offsets, line_idx, from_m, to_m = split_line.split_lines(self.xy, self.offsets, 25.0)
+        first = line_array.first_points(seg_xy, seg_offsets)
+        last = line_array.last_points(seg_xy, seg_offsets)
+        same_line = line_idx[1:] == line_idx[:-1]
+        np.testing.assert_allclose(first[1:][same_line], last[:-1][same_line])
+        starts = np.concatenate(([True], ~same_line))
+        np.testing.assert_allclose(first[starts], line_array.first_points(self.xy, self.offsets)[line_idx[starts]])
+
+
+class MergeLinesTest(unittest.TestCase):
+
+    def test_merge(self):
+        xy = np.array([[0, 0], [1, 0], [1, 0], [2, 0], [5, 5], [6, 5], [2.001, 0], [3, 0]], dtype=np.float64)
+        offsets = np.array([0, 2, 4, 6, 8])
+        # lines 0, 1 and 3 form one merged line (in that order), line 2 another
+        order = np.array([0, 1, 3, 2])
+        group = np.array([0, 0, 1, 0])
+        mxy, moffsets, set_start, first_idx = topology.merge_lines(xy, offsets, order, group, 0.01)
+        np.testing.assert_array_equal(moffsets, [0, 4, 6])
+        np.testing.assert_allclose(mxy[:4], [[0, 0], [1, 0], [2, 0], [3, 0]])
+        np.testing.assert_array_equal(set_start, [0, 3])
+        np.testing.assert_array_equal(first_idx, [0, 1, 2, 4])
+
+    def test_gap_keeps_vertex(self):
+        xy = np.array([[0, 0], [1, 0], [1.5, 0], [2, 0]], dtype=np.float64)
+        mxy, moffsets, set_start, first_idx = topology.merge_lines(xy, np.array([0, 2, 4]), np.array([0, 1]),
+                                                                   np.array([0, 0]), 0.01)
+        self.assertEqual(len(mxy), 4)
+        np.testing.assert_array_equal(first_idx, [0, 2])
+
+
+class PointNodesTest(unittest.TestCase):
+
+    def test_against_union_find(self):
+        rng = np.random.RandomState(8)
+        pts = np.round(rng.rand(400, 2) * 4, 2) + rng.rand(400, 2) * 0.004
+        parent = list(range(len(pts)))
+        for i in range(len(pts)):
+            for j in range(i):
+                if np.hypot(*(pts[i] - pts[j])) <= 0.01:
+                    topology.union(parent, i, j)
+        root = topology.roots(parent)
+        # nodes are numbered by their smallest point index
+        expected = np.array([np.flatnonzero(root == r).min() for r in root])
+        np.testing.assert_array_equal(topology.point_nodes(pts, 0.01), expected)
+
+    def test_chained_points(self):
+        pts = np.array([[0, 0], [0.008, 0], [0.016, 0], [5, 5]])
+        np.testing.assert_array_equal(topology.point_nodes(pts, 0.01), [0, 0, 0, 3])
+
+
+class BreakCyclesTest(unittest.TestCase):
+
+    def test_chains_kept_cycles_cut(self):
+        # chain 0 -> 1 -> 2, cycle 3 -> 4 -> 5 -> 3, self link 6
+        nxt = topology.break_cycles([1, 2, 2, 4, 5, 3, 6])
+        np.testing.assert_array_equal(nxt, [1, 2, 2, 4, 5, 5, 6])
+        last, to_last = topology.chain_ends(nxt)
+        np.testing.assert_array_equal(last, [2, 2, 2, 5, 5, 5, 6])
+        np.testing.assert_array_equal(to_last, [2, 1, 0, 2, 1, 0, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
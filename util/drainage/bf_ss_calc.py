@@ -5,48 +5,101 @@
 #				published in 2014 (see Beechie, T., and H. Imaki (2014), Predicting natural
 #				channel patterns based on landscape and geomorphic controls in the Columbia
 #				River basin, USA, Water Resour. Res., 50, 39-57, doi: 10.1002/2013WR013629).	  
+#				All four values are calculated together from the fa, ppt and Slope fields, read once
+#				as arrays and written back in one pass.
 # author:		Jesse Langdon
-# dependencies: ESRI arcpy module
+# dependencies: ESRI arcpy module, numpy
 
 import os, sys, arcpy
-# arcpy.env.overwriteOutput = True
-
-#temp variables
-# outFGB = r"C:\_auto\outputs\test.gdb"
-# inLine = outFGB + "\\seg_final"
-
-# calculate bankful width
-def bfw_calc(inLine, outFGB):
-	arcpy.AddMessage("Calculating bankful width...")
-	arcpy.MakeFeatureLayer_management(inLine, "inLine_bfw_lyr")
-	arcpy.AddField_management("inLine_bfw_lyr", "bfw_m", "DOUBLE")
-	# PRISM precipitation values are in millimeters, so convert to 
-#	bfwOut = arcpy.CalculateField_management("inLine_bfw_lyr", "bfw_m", 
-#									"""math.exp(-1.73229) * ((!fa! * 10.0 * 10.0 / 1000000.0)**0.39659) * (((!ppt!/!fa!)/10)**0.45304)""", "PYTHON_9.3")
-	bfwOut = arcpy.CalculateField_management("inLine_bfw_lyr", "bfw_m", 
-									"""math.exp(-1.73229) * ((!fa! * 10.0 * 10.0 / 1000000.0)**0.39659) * ((!ppt!)**0.45304)""", "PYTHON_9.3")
-	return bfwOut
-
-# calculate bankful depth
-def bfd_calc(inLine, outFGB):
-	arcpy.AddMessage("Calculating bankful depth...")
-	arcpy.MakeFeatureLayer_management(inLine, "inLine_bfd_lyr")
-	arcpy.AddField_management("inLine_bfd_lyr", "bfd_m", "DOUBLE")
-	bfdOut = arcpy.CalculateField_management("inLine_bfd_lyr", "bfd_m", """0.145 * !bfw_m!**0.607""", "PYTHON_9.3")
-	return bfdOut
-
-#calculate shear stress
-def ss_calc(inLine, outFGB):
-	arcpy.AddMessage("Calculating shear stress...")
-	arcpy.MakeFeatureLayer_management(inLine, "inLine_ss_lyr")
-	arcpy.AddField_management("inLine_ss_lyr", "ss", "DOUBLE")
-	ssOut = arcpy.CalculateField_management("inLine_ss_lyr", "ss", """9.81 * 999 * !Slope! * (!bfw_m! * !bfd_m!) / (!bfw_m! + 2 * !bfd_m!)""", "PYTHON_9.3")
-	return ssOut
-
-#calculate floodplain depth
-def fpd_calc(inLine, outFGB):
-	arcpy.AddMessage("Calculating floodplain depth...")
-	arcpy.MakeFeatureLayer_management(inLine, "inLine_fpd_lyr")
-	arcpy.AddField_management("inLine_fpd_lyr", "fpd_m", "DOUBLE")
-	fpdOut = arcpy.CalculateField_management("inLine_fpd_lyr", "fpd_m", """!bfd_m! * 3""", "PYTHON_9.3")
-	return fpdOut
\ No newline at end of file
+import numpy as np
+from .. import table_array
+
+# regional curve coefficients: bankfull width = exp(ln a) * area^b * ppt^c (area in km2), bankfull
+# depth = d * width^e, and floodplain depth = bankfull depth * f
+COEFFICIENTS = (-1.73229, 0.39659, 0.45304, 0.145, 0.607, 3.0)
+
+# area of one cell of a raster, in the squared units of the raster (e.g. the flow accumulation)
+def cell_area(in_raster):
+	d = arcpy.Describe(in_raster)
+	return float(d.meanCellWidth) * float(d.meanCellHeight)
+
+# bankfull width, bankfull depth, shear stress and floodplain depth from arrays of flow accumulation
+# (cells), precipitation and slope. Null (NaN) or negative flow accumulation or precipitation gives
+# null for all four values, and null or negative slope, or no drainage area or precipitation, gives
+# a null shear stress. The coefficients may be scalars, or columns of shape (k, 1) to evaluate k
+# coefficient sets at once, which gives results of shape (k, number of segments).
+def hydraulics(fa, ppt, slope, cellArea, coef=COEFFICIENTS):
+	lna, b, c, d, e, f = coef
+	fa = np.asarray(fa, dtype=np.float64)
+	ppt = np.asarray(ppt, dtype=np.float64)
+	slope = np.asarray(slope, dtype=np.float64)
+	shape = np.broadcast(lna, fa).shape
+	ok = ~np.isnan(fa) & ~np.isnan(ppt)
+	ok[ok] = (fa[ok] >= 0) & (ppt[ok] >= 0)
+	bfw = np.empty(shape)
+	bfw[...] = np.nan
+	bfw[..., ok] = np.exp(lna) * (fa[ok] * cellArea / 1000000.0) ** b * ppt[ok] ** c
+	bfd = d * bfw ** e
+	wet = ok & ~np.isnan(slope)
+	wet[wet] = (slope[wet] >= 0) & (fa[wet] > 0) & (ppt[wet] > 0)
+	ss = np.empty(shape)
+	ss[...] = np.nan
+	ss[..., wet] = 9.81 * 999 * slope[wet] * (bfw[..., wet] * bfd[..., wet]) / (bfw[..., wet] + 2 * bfd[..., wet])
+	return {"bfw_m": bfw, "bfd_m": bfd, "ss": ss, "fpd_m": bfd * f}
+
+# evaluate many sets of regional curve coefficients against the same segments. coefs is a (k, 6)
+# matrix with one set per row, in the order of COEFFICIENTS (ln a, area exponent, ppt exponent, depth
+# coefficient, depth exponent, floodplain multiplier). Returns a dictionary with a (k, number of
+# segments) array per output, or with percentiles (a list of numbers from 0 to 100) a (number of
+# percentiles, number of segments) array of the percentiles over the coefficient sets, where
+# segments without a value for every set are null. Segments are processed chunk_size at a time to
+# bound memory.
+def ensemble(fa, ppt, slope, cellArea, coefs, percentiles=None, chunk_size=10000):
+	coefs = np.atleast_2d(np.asarray(coefs, dtype=np.float64))
+	columns = [coefs[:, i:i + 1] for i in range(coefs.shape[1])]
+	n = len(fa)
+	rows = len(coefs) if percentiles is None else len(percentiles)
+	out = {}
+	for name in ["bfw_m", "bfd_m", "ss", "fpd_m"]:
+		out[name] = np.empty((rows, n))
+	for first in range(0, n, chunk_size):
+		chunk = slice(first, min(first + chunk_size, n))
+		result = hydraulics(fa[chunk], ppt[chunk], slope[chunk], cellArea, columns)
+		for name in out:
+			if percentiles is None:
+				out[name][:, chunk] = result[name]
+			else:
+				vals = result[name]
+				null = np.isnan(vals).any(axis=0)
+				pct = np.array([np.percentile(np.where(null, 0.0, vals), q, axis=0) for q in percentiles])
+				pct[:, null] = np.nan
+				out[name][:, chunk] = pct
+	return out
+
+# read fa, ppt and Slope per segment, as arrays with nulls as NaN
+def read_inputs(inLine):
+	fields = ["fa", "ppt", "Slope"]
+	return table_array.read_columns(inLine, fields, null_value=dict((f, np.nan) for f in fields))
+
+# evaluate a matrix of coefficient sets (see ensemble) against the segments of inLine, read once.
+# Returns the OIDs of the segments and the ensemble results, without changing inLine.
+def ensemble_calc(inLine, inRaster, coefs, percentiles=None):
+	arcpy.AddMessage("Evaluating " + str(len(coefs)) + " sets of regional curve coefficients...")
+	cols = read_inputs(inLine)
+	return cols["OID@"], ensemble(cols["fa"], cols["ppt"], cols["Slope"], cell_area(inRaster), coefs, percentiles)
+
+# calculate bankfull width, bankfull depth, shear stress and floodplain depth per segment, in
+# place. inRaster is the flow accumulation raster, which gives the area of the cells counted in fa.
+def hydraulic_calc(inLine, inRaster, outFGB):
+	arcpy.AddMessage("Calculating bankfull width and depth, shear stress and floodplain depth...")
+	cols = read_inputs(inLine)
+	out = hydraulics(cols["fa"], cols["ppt"], cols["Slope"], cell_area(inRaster))
+	table_array.write_columns(inLine, cols["OID@"], out)
+	return inLine
+
+# hydraulic_calc for the segments of a SegmentTable (see segment_table.py): the four values are added
+# to the table as columns
+def hydraulic_table(table, inRaster):
+	arcpy.AddMessage("Calculating bankfull width and depth, shear stress and floodplain depth...")
+	table.update(hydraulics(table["fa"], table["ppt"], table["Slope"], cell_area(inRaster)))
+	return table
@@ -8,53 +8,62 @@
 #				project, with the ultimate goal of providing information to be used in salmonid habitat modeling.
 #               Much of the code in this script was derived from code originally written by Hiroo Imaki.
 # author:		Jesse Langdon
-# dependencies: none
+# dependencies: ESRI arcpy module, numpy
 
 import arcpy
+import numpy as np
+from .. import table_array
 
-def main(input_strm, param, outFGB):
+# params is a list of parameter field names (a single field name is also accepted). For each
+# parameter a "<param>_r" field is added: the first reach of each stream (lowest LineOID) keeps its
+# own value, and every other reach gets the absolute difference from that first value.
+def main(input_strm, params, outFGB):
+    if isinstance(params, basestring):
+        params = [params]
 
-    # Add a new field to store the relative shear stress values
+    # Add new fields to store the relative values
     arcpy.FeatureClassToFeatureClass_conversion(input_strm, r"in_memory", "rel_calc")
     rel_calc = arcpy.MakeFeatureLayer_management(r"in_memory\rel_calc", "rel_calc_lyr")
     #arcpy.FeatureClassToFeatureClass_conversion(input_strm, outFGB, "rel_calc")
     #arcpy.MakeFeatureLayer_management(outFGB + r"\rel_calc", "rel_calc_lyr")
-    calc_field = param + "_r"
-    arcpy.AddField_management("rel_calc_lyr", calc_field, "DOUBLE")
-
-    # compile list of stream IDs
-    strm_id = []
-    with arcpy.da.SearchCursor("rel_calc_lyr", ["strmID"]) as cursor_sid:
-        for row_sid in cursor_sid:
-            strm_id.append(row_sid[0])
-    strm_id_unique = sorted(set(strm_id))
-
-    # use data access (da) update cursor to calculate relative values
-    for id in strm_id_unique:
-        arcpy.SelectLayerByAttribute_management("rel_calc_lyr", "NEW_SELECTION", """"strmID" = '%s'""" % id)
-        cursor_param = arcpy.da.UpdateCursor("rel_calc_lyr", ["LineOID", param, calc_field])
-        reach_counter = 1
-        old_val = 0
-        for row_param in cursor_param:
-            print row_param[0]
-            # store the parameter value for the first reach of the stream
-            if reach_counter == 1:
-                old_val = row_param[1]
-                row_param[2] = old_val
-                reach_counter += 1
-                cursor_param.updateRow(row_param)
-                continue
-            # if other than the first stream reach, calculate relative value
-            else:
-                row_param[2] = abs(row_param[1] - old_val)
-                reach_counter += 1
-                cursor_param.updateRow(row_param)
-        del row_param
-        del cursor_param
+    calc_fields = [param + "_r" for param in params]
+    for calc_field in calc_fields:
+        arcpy.AddField_management("rel_calc_lyr", calc_field, "DOUBLE")
+
+    # read the stream IDs and parameter values once, and write the relative values back in one pass
+    null_value = dict([("strmID", "")] + [(param, np.nan) for param in params])
+    cols = table_array.read_columns(r"in_memory\rel_calc", ["strmID", "LineOID"] + params, null_value=null_value)
+    out = relative_values(cols["strmID"], cols["LineOID"], [cols[param] for param in params])
+    table_array.write_columns(r"in_memory\rel_calc", cols["OID@"], dict(zip(calc_fields, out)))
 
     return rel_calc
 
 
+# main for the segments of a SegmentTable (see segment_table.py): the "<param>_r" columns are added to
+# the table
+def relative_table(table, params):
+    if isinstance(params, basestring):
+        params = [params]
+    out = relative_values(table["strmID"], table["LineOID"], [table[param] for param in params])
+    table.update(dict(zip([param + "_r" for param in params], out)))
+    return table
 
 
+# relative values of each array of values: the reaches are ordered by stream ID (strm_id, with ""
+# for none), then LineOID. Returns one array per array of values, in the order of the reaches given.
+def relative_values(strm_id, line_oid, values):
+    order = np.lexsort((line_oid, strm_id))
+    strm_id = strm_id[order]
+    first = np.concatenate(([True], strm_id[1:] != strm_id[:-1])) if len(order) else np.zeros(0, bool)
+    first_idx = np.flatnonzero(first)[np.cumsum(first) - 1]
+    # reaches without a stream ID are left null
+    no_id = strm_id == ""
 
+    out = []
+    for v in values:
+        val = np.asarray(v)[order].astype(np.float64)
+        rel = np.where(first, val, np.abs(val - val[first_idx]))
+        rel[no_id] = np.nan
+        out.append(np.empty(len(order)))
+        out[-1][order] = rel
+    return out
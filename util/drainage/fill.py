@@ -0,0 +1,294 @@
+# file name:	fill.py
+# description:	Priority-flood depression filling of a DEM held as a NumPy array, as a replacement for the
+#				Spatial Analyst Fill tool.  This follows the "improved priority-flood" of Barnes, Lehman
+#				and Mulla (2014, Computers & Geosciences 62: 117-127): cells on the edge of the data
+#				(next to NoData or the raster border) seed a priority queue, and cells are visited from
+#				the lowest up, so every cell is raised to the lowest level at which it can drain off the
+#				edge.  Cells found inside a depression or a flat go on a plain FIFO queue instead of the
+#				priority queue, which keeps the cost of large filled areas linear.  The runtime is
+#				O(n log n) for n cells, with O(n) for cells in depressions.  An optional epsilon raises
+#				each filled cell a little above the cell it was reached from, so that filled areas keep
+#				a gradient towards their outlet (Priority-Flood + epsilon, Algorithm 4 of the paper).
+#				fill holds the whole DEM in memory (as float64, plus the queues and a visited flag per
+#				cell).  fill_tiled fills a memory-mapped DEM tile by tile, optionally in a process
+#				pool, following the parallel priority-flood of Barnes (2016): each tile is flooded on
+#				its own, the levels at which its watersheds spill into each other and into the
+#				neighbouring tiles are resolved on a small graph, and each tile is flooded again from
+#				its edge cells raised to their final level.
+# author:		Jesse Langdon
+# dependencies: numpy (ESRI arcpy module through raster_tile.py, and Spatial Analyst extension for
+#				benchmark only)
+
+import time, heapq, array, collections
+import numpy as np
+import raster_tile as rT
+
+
+# priority-flood over a DEM window held as a flat array.array of float64 elevations z (changed in
+# place), width cells wide, from the seed cells. closed is a bytearray set for NoData cells and the
+# seeds, so that NoData is never entered. With label and edges given, every cell takes the label of
+# the cell it was reached from, and edges records, for every pair of labels that meet, the lowest
+# level at which they meet (the higher of the two cells), keyed on the (lower, higher) label pair.
+def _flood(z, closed, width, seeds, epsilon=0.0, label=None, edges=None):
+    open_cells = [(z[i], i) for i in seeds]
+    heapq.heapify(open_cells)
+    pit = collections.deque()
+    neighbours = [-width - 1, -width, -width + 1, -1, 1, width - 1, width, width + 1]
+
+    heappop = heapq.heappop
+    heappush = heapq.heappush
+    while open_cells or pit:
+        if pit:
+            c = pit.popleft()
+            # with an epsilon gradient, edge cells at the same level are taken first
+            if epsilon and open_cells and open_cells[0][0] == z[c]:
+                pit.appendleft(c)
+                c = heappop(open_cells)[1]
+        else:
+            c = heappop(open_cells)[1]
+        zc = z[c]
+        lc = label[c] if edges is not None else 0
+        for d in neighbours:
+            n = c + d
+            if closed[n]:
+                if edges is not None:
+                    ln = label[n]
+                    if ln and ln != lc:
+                        key = (lc, ln) if lc < ln else (ln, lc)
+                        level = zc if zc > z[n] else z[n]
+                        if level < edges.get(key, level + 1.0):
+                            edges[key] = level
+                continue
+            closed[n] = 1
+            if edges is not None:
+                label[n] = lc
+            if z[n] <= zc + epsilon:
+                # n drains through c: raise it to the level of c and take it next, without sorting
+                z[n] = zc + epsilon
+                pit.append(n)
+            else:
+                heappush(open_cells, (z[n], n))
+
+
+# the window of a DEM around cells r0:r1, c0:c1 with a border of one cell, as a flat array.array of
+# float64 elevations and a bytearray of closed cells, with the border closed so that a flood stays
+# within the window. Also returns the window width and the flat window indexes of the outlet cells
+# (cells with data next to NoData or the edge of the DEM) and of the other cells with data on the
+# edge of the window interior.
+def _window(dem, r0, r1, c0, c1):
+    pad = rT.read_window(dem, r0 - 1, r1 + 1, c0 - 1, c1 + 1, np.nan).astype(np.float64)
+    nrows, ncols = r1 - r0, c1 - c0
+    valid = ~np.isnan(pad)
+    all_valid = valid[1:-1, 1:-1].copy()
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            all_valid &= valid[1 + dy:nrows + 1 + dy, 1 + dx:ncols + 1 + dx]
+    outlet = np.zeros(pad.shape, dtype=bool)
+    outlet[1:-1, 1:-1] = valid[1:-1, 1:-1] & ~all_valid
+    border = np.zeros(pad.shape, dtype=bool)
+    border[1, 1:-1] = border[-2, 1:-1] = border[1:-1, 1] = border[1:-1, -2] = True
+    border &= valid & ~outlet
+
+    # compact arrays that are quick to index from python
+    valid[0, :] = valid[-1, :] = valid[:, 0] = valid[:, -1] = False
+    z = array.array("d")
+    z.fromstring(pad.tostring())
+    closed = bytearray((~valid | outlet | border).astype(np.uint8).tostring())
+    return z, closed, ncols + 2, np.flatnonzero(outlet), np.flatnonzero(border)
+
+
+# interior of a flat window array as a 2D float64 array
+def _interior(z, r0, r1, c0, c1):
+    return np.frombuffer(z, dtype=np.float64).reshape(r1 - r0 + 2, c1 - c0 + 2)[1:-1, 1:-1]
+
+
+# global flat index of window cells of the tile r0:r1, c0:c1 of a grid ncols wide
+def _global_index(win_idx, r0, c0, win_width, ncols):
+    return (r0 - 1 + win_idx // win_width) * ncols + c0 - 1 + win_idx % win_width
+
+
+# fill the depressions of a DEM array. NaN cells are NoData: they are not filled, and cells next to
+# them are treated as edge cells. Elevations are processed as float64 and returned in the dtype
+# of dem. The whole DEM is held in memory; see fill_tiled for large DEMs.
+def fill(dem, epsilon=0.0):
+    nrows, ncols = dem.shape
+    z, closed, width, outlet, border = _window(np.asarray(dem, dtype=np.float64), 0, nrows, 0, ncols)
+    _flood(z, closed, width, outlet.tolist(), epsilon)
+    return _interior(z, 0, nrows, 0, ncols).astype(dem.dtype)
+
+
+# tiled fill pass 1: flood one tile from its outlet cells (label 1) and the other cells on its edge
+# (labels 2 and up), without epsilon. Returns the number of labels, the levels at which the labels
+# meet inside the tile, and the global index, label and elevation of the cells on the tile edge.
+def _label_tile(job):
+    dem_path, tile = job
+    r0, r1, c0, c1 = tile
+    dem = np.lib.format.open_memmap(dem_path, mode="r")
+    ncols = dem.shape[1]
+    z, closed, width, outlet, border = _window(dem, r0, r1, c0, c1)
+    del dem
+    label = array.array("i", [0]) * len(z)
+    for i in outlet.tolist():
+        label[i] = 1
+    for k, i in enumerate(border.tolist()):
+        label[i] = k + 2
+    edges = {}
+    _flood(z, closed, width, outlet.tolist() + border.tolist(), 0.0, label, edges)
+
+    pairs = np.array(list(edges.keys()), dtype=np.int64).reshape(-1, 2)
+    levels = np.array(list(edges.values()), dtype=np.float64)
+    # cells on the edge of the tile, outlet cells included
+    edge_idx = np.concatenate((outlet, border))
+    edge_idx = edge_idx[_on_tile_edge(edge_idx, width, r1 - r0, c1 - c0)]
+    lab = np.frombuffer(label, dtype=np.int32)[edge_idx]
+    zed = np.frombuffer(z, dtype=np.float64)[edge_idx]
+    return len(border) + 2, pairs, levels, _global_index(edge_idx, r0, c0, width, ncols), lab, zed
+
+
+# whether window indexes are on the edge of the window interior (nrows x ncols cells)
+def _on_tile_edge(win_idx, width, nrows, ncols):
+    r = win_idx // width
+    c = win_idx % width
+    return (r == 1) | (r == nrows) | (c == 1) | (c == ncols)
+
+
+# tiled fill pass 2: flood one tile from its outlet cells and from the cells on its edge, set to
+# their final level, and write the filled tile
+def _fill_tile(job):
+    dem_path, out_path, tile, edge_global, edge_level = job
+    r0, r1, c0, c1 = tile
+    dem = np.lib.format.open_memmap(dem_path, mode="r")
+    ncols = dem.shape[1]
+    z, closed, width, outlet, border = _window(dem, r0, r1, c0, c1)
+    del dem
+    rows, cols = divmod(np.asarray(edge_global, dtype=np.int64), ncols)
+    for i, level in zip(((rows - r0 + 1) * width + cols - c0 + 1).tolist(), np.asarray(edge_level).tolist()):
+        if level > z[i]:
+            z[i] = level
+    _flood(z, closed, width, outlet.tolist() + border.tolist())
+    out = np.lib.format.open_memmap(out_path, mode="r+")
+    out[r0:r1, c0:c1] = _interior(z, r0, r1, c0, c1)
+    out.flush()
+    del out
+
+
+# lowest level at which each node of a graph drains to node 0: the lowest, over the paths from the
+# node to node 0, of the highest edge level on the path (found with a priority queue from node 0).
+# Nodes without a path to node 0 get -inf, so they are not raised.
+def _spill_levels(n_nodes, a, b, levels):
+    src = np.concatenate((a, b))
+    dst = np.concatenate((b, a))
+    lev = np.concatenate((levels, levels))
+    order = np.argsort(src, kind="mergesort")
+    start = np.searchsorted(src[order], np.arange(n_nodes + 1)).tolist()
+    dst = dst[order].tolist()
+    lev = lev[order].tolist()
+    spill = [np.inf] * n_nodes
+    spill[0] = -np.inf
+    done = bytearray(n_nodes)
+    queue = [(-np.inf, 0)]
+    while queue:
+        s, u = heapq.heappop(queue)
+        if done[u]:
+            continue
+        done[u] = 1
+        for k in range(start[u], start[u + 1]):
+            v = dst[k]
+            level = s if s > lev[k] else lev[k]
+            if level < spill[v]:
+                spill[v] = level
+                heapq.heappush(queue, (level, v))
+    spill = np.array(spill)
+    spill[np.isinf(spill)] = -np.inf
+    return spill
+
+
+# tile-parallel fill of a memory-mapped DEM array (.npy path, NaN for NoData) into a new float64
+# memory-mapped array at out_path, with the same result as fill. This follows the tiled
+# priority-flood of Barnes (2016, "Parallel priority-flood depression filling for trillion cell
+# digital elevation models", Computers & Geosciences 96: 56-68). Pass 1 floods every tile on its own
+# from its outlet cells and the cells on its edge, labelling each cell with the seed it was reached
+# from and recording the level at which neighbouring labels meet. Those levels, plus the levels
+# between the edge cells of neighbouring tiles, form a small graph of labels, on which the level at
+# which each label drains to an outlet is found. Pass 2 raises the edge cells of every tile to
+# their final level and floods the tile again. Only one tile of the DEM is held in memory per
+# process; the graph has about four nodes per tile_size cells. There is no epsilon gradient: a
+# depression that spans tiles fills to a flat on the tile edges, as the edge cells do not know how
+# far they are from the outlet of the depression.
+def fill_tiled(dem_path, out_path, tile_size, processes=1):
+    dem = np.lib.format.open_memmap(dem_path, mode="r")
+    nrows, ncols = dem.shape
+    del dem
+    tile_list = rT.tiles(rT.Grid(0.0, 0.0, 1.0, nrows, ncols, None), tile_size)
+    results = rT.run_jobs(_label_tile, [(dem_path, t) for t in tile_list], processes)
+
+    # global labels: 0 for the outlets of all tiles, then the edge cell labels of each tile in turn
+    base = np.cumsum([0] + [r[0] - 2 for r in results])
+    def to_global(lab, k):
+        return np.where(lab == 1, 0, base[k] + lab - 1)
+    a = [to_global(r[1][:, 0], k) for k, r in enumerate(results)]
+    b = [to_global(r[1][:, 1], k) for k, r in enumerate(results)]
+    levels = [r[2] for r in results]
+    edge_global = np.concatenate([r[3] for r in results])
+    edge_label = np.concatenate([to_global(r[4], k) for k, r in enumerate(results)])
+    edge_z = np.concatenate([r[5] for r in results])
+
+    # edge cells of neighbouring tiles meet at the higher of their two elevations
+    order = np.argsort(edge_global)
+    sorted_idx = edge_global[order]
+    rows, cols = divmod(edge_global, ncols)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if not (dy or dx):
+                continue
+            r = rows + dy
+            c = cols + dx
+            inside = np.flatnonzero((r >= 0) & (r < nrows) & (c >= 0) & (c < ncols))
+            nb = r[inside] * ncols + c[inside]
+            pos = np.minimum(np.searchsorted(sorted_idx, nb), len(sorted_idx) - 1)
+            found = sorted_idx[pos] == nb
+            i = inside[found]
+            j = order[pos[found]]
+            a.append(edge_label[i])
+            b.append(edge_label[j])
+            levels.append(np.maximum(edge_z[i], edge_z[j]))
+    spill = _spill_levels(int(base[-1]) + 1, np.concatenate(a), np.concatenate(b), np.concatenate(levels))
+    edge_level = np.maximum(edge_z, spill[edge_label])
+
+    out = np.lib.format.open_memmap(out_path, mode="w+", dtype=np.float64, shape=(nrows, ncols))
+    del out
+    bounds = np.cumsum([0] + [len(r[3]) for r in results])
+    jobs = [(dem_path, out_path, t, edge_global[bounds[k]:bounds[k + 1]], edge_level[bounds[k]:bounds[k + 1]])
+            for k, t in enumerate(tile_list)]
+    rT.run_jobs(_fill_tile, jobs, processes)
+    return out_path
+
+
+# compare the priority-flood fill with the Spatial Analyst Fill tool on a DEM raster: reports the
+# runtime of each and how far the filled surfaces differ, and returns the figures as a dictionary
+def benchmark(in_dem, epsilon=0.0):
+    import arcpy
+    from arcpy.sa import Fill
+
+    dem = arcpy.RasterToNumPyArray(in_dem, nodata_to_value=np.nan).astype(np.float64)
+    start = time.time()
+    filled = fill(dem, epsilon)
+    pf_time = time.time() - start
+
+    start = time.time()
+    esri_fill = Fill(in_dem, "#")
+    esri = arcpy.RasterToNumPyArray(esri_fill, nodata_to_value=np.nan).astype(np.float64)
+    esri_time = time.time() - start
+
+    both = ~np.isnan(filled) & ~np.isnan(esri)
+    diff = np.abs(filled[both] - esri[both])
+    result = {"cells": int(dem.size),
+              "priority_flood_seconds": pf_time,
+              "esri_fill_seconds": esri_time,
+              "max_difference": float(diff.max()) if len(diff) else 0.0,
+              "mean_difference": float(diff.mean()) if len(diff) else 0.0,
+              "cells_different": int((diff > 1e-3).sum()),
+              "cells_filled": int((filled[both] > dem[both]).sum())}
+    for key in sorted(result):
+        arcpy.AddMessage(key + ": " + str(result[key]))
+    return result
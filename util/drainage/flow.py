@@ -0,0 +1,323 @@
+# file name:	flow.py
+# description:	D8 flow direction and flow accumulation over NumPy arrays, as a replacement for the
+#				Spatial Analyst FlowDirection and FlowAccumulation tools.  Flow directions use the ESRI
+#				D8 codes (1 = east, 2 = southeast, 4 = south, 8 = southwest, 16 = west, 32 = northwest,
+#				64 = north, 128 = northeast), with edge cells flowing out of the raster ("NORMAL").
+#				Accumulation visits the cells in topological order (Kahn's algorithm): the cells with no
+#				upstream cells left form a "wave", their totals are passed downstream with np.bincount,
+#				and the cells whose upstream cells have all been visited form the next wave.  Any number
+#				of weight rasters (e.g. unit area and precipitation) are accumulated in the same waves,
+#				so extra weights add little to the cost of the traversal.  accumulate_tiled runs the
+#				accumulation tile by tile in a process pool, and resolves the flow between tiles on a
+#				small graph of the cells where flow enters a tile.  d8_direction, resolve_flats,
+#				downstream and accumulate work on the whole grid at once and hold several arrays of
+#				its size in memory (downstream alone uses 24 bytes per cell); accumulate_tiled keeps
+#				one tile of each raster in memory at a time and is the path to use for large grids.
+# author:		Jesse Langdon
+# dependencies: numpy (ESRI arcpy module through raster_tile.py)
+
+import os, collections
+import numpy as np
+import raster_tile as rT
+
+# ESRI D8 codes and the (row, column) step to the downstream cell for each
+D8_CODES = [1, 2, 4, 8, 16, 32, 64, 128]
+D8_STEPS = [(0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1)]
+
+
+# D8 flow direction of every cell of a (filled) DEM: the code of the neighbour with the steepest
+# drop (distance-weighted, so diagonal drops are divided by sqrt(2)). Cells next to NoData or the
+# raster border flow outward. Cells on flats flow towards the nearest cell of the flat that drains
+# (found breadth first). NoData cells, and pits that cannot drain, get 0. The whole DEM is held in
+# memory, with several temporary arrays of its size.
+def d8_direction(dem):
+    nrows, ncols = dem.shape
+    pad = np.empty((nrows + 2, ncols + 2), dtype=np.float64)
+    pad[...] = np.nan
+    pad[1:-1, 1:-1] = dem
+    valid = ~np.isnan(dem)
+
+    fdir = np.zeros(dem.shape, dtype=np.uint8)
+    best = np.zeros(dem.shape)
+    edge_dir = np.zeros(dem.shape, dtype=np.uint8)
+    for code, (dy, dx) in reversed(list(zip(D8_CODES, D8_STEPS))):
+        nbr = pad[1 + dy:nrows + 1 + dy, 1 + dx:ncols + 1 + dx]
+        drop = np.nan_to_num((dem - nbr) / (np.sqrt(2.0) if dy and dx else 1.0))
+        # ties go to the first code in D8 order, which is applied last
+        steeper = valid & (drop >= best) & (drop > 0)
+        fdir[steeper] = code
+        best[steeper] = drop[steeper]
+        edge_dir[valid & np.isnan(nbr)] = code
+
+    # edge cells flow out of the raster
+    edge = edge_dir > 0
+    fdir[edge] = edge_dir[edge]
+    resolve_flats(dem, fdir)
+    return fdir
+
+
+# give the cells of flats (valid cells without a downslope neighbour) a direction towards a
+# neighbouring cell of the same elevation that already drains, breadth first from the flat outlets.
+# The cells still to visit are kept in a Python set, so very large flats take a lot of memory.
+def resolve_flats(dem, fdir):
+    nrows, ncols = dem.shape
+    flat = ~np.isnan(dem) & (fdir == 0)
+    if not flat.any():
+        return fdir
+    z = dem.ravel()
+    flat_cells = set(np.flatnonzero(flat).tolist())
+    out = fdir.ravel()
+    queue = collections.deque()
+    # the first cells visited are the drained neighbours of flat cells, at the same elevation
+    for c in flat_cells:
+        r, k = divmod(c, ncols)
+        for dy, dx in D8_STEPS:
+            rr, kk = r + dy, k + dx
+            if 0 <= rr < nrows and 0 <= kk < ncols:
+                n = rr * ncols + kk
+                if n not in flat_cells and out[n] and z[n] == z[c]:
+                    queue.append(n)
+    seen = set(queue)
+    while queue:
+        n = queue.popleft()
+        r, k = divmod(n, ncols)
+        for code, (dy, dx) in zip(D8_CODES, D8_STEPS):
+            rr, kk = r - dy, k - dx
+            if 0 <= rr < nrows and 0 <= kk < ncols:
+                c = rr * ncols + kk
+                if c in flat_cells and c not in seen and z[c] == z[n]:
+                    # c flows in direction (dy, dx) to n
+                    out[c] = code
+                    seen.add(c)
+                    queue.append(c)
+    return fdir
+
+
+# flat index of the downstream cell of every cell, or -1 where the flow leaves the raster, enters
+# NoData, or the cell has no direction. The row, column and downstream indexes are int64, 24 bytes
+# per cell of the grid in all.
+def downstream(fdir):
+    nrows, ncols = fdir.shape
+    rows, cols = np.indices(fdir.shape)
+    down = -np.ones(fdir.shape, dtype=np.int64)
+    for code, (dy, dx) in zip(D8_CODES, D8_STEPS):
+        sel = fdir == code
+        r = rows[sel] + dy
+        c = cols[sel] + dx
+        inside = (r >= 0) & (r < nrows) & (c >= 0) & (c < ncols)
+        target = -np.ones(len(r), dtype=np.int64)
+        target[inside] = r[inside] * ncols + c[inside]
+        down[sel] = target
+    down = down.ravel()
+    # flow into a cell without a direction (NoData) leaves the network
+    inner = down >= 0
+    down[inner] = np.where(fdir.ravel()[down[inner]] > 0, down[inner], -1)
+    return down
+
+
+# flow accumulation of any number of weights over a flow direction grid, in one traversal. weights
+# is a list of arrays with the shape of fdir, where None stands for a unit weight (the unweighted
+# cell count of FlowAccumulation). As in FlowAccumulation, each cell gets the total weight of the
+# cells upstream of it, not counting itself, and NaN weights count as 0. Cells without a flow
+# direction are NaN in the results. The whole grid is held in memory; see accumulate_tiled.
+def accumulate(fdir, weights):
+    valid = fdir.ravel() > 0
+    w = [None if wt is None else np.asarray(wt).ravel() for wt in weights]
+    acc = accumulate_down(downstream(fdir), valid, w)
+    for a in acc:
+        a[~valid] = np.nan
+    return [a.reshape(fdir.shape) for a in acc]
+
+
+# accumulation over flat downstream indexes (-1 where the flow leaves), for the cells where valid is
+# set. weights is a list of flat arrays or None (unit weight); returns one flat array per weight.
+def accumulate_down(down, valid, weights):
+    n = len(down)
+    w = [np.ones(n) if wt is None else np.nan_to_num(np.asarray(wt, dtype=np.float64)) for wt in weights]
+    acc = [np.zeros(n) for wt in weights]
+
+    indeg = np.bincount(down[down >= 0], minlength=n)
+    wave = np.flatnonzero((indeg == 0) & valid)
+    while len(wave):
+        d = down[wave]
+        src = wave[d >= 0]
+        d = d[d >= 0]
+        if len(d) == 0:
+            break
+        # pass the totals of this wave to the downstream cells, summed per downstream cell
+        cells, inv = np.unique(d, return_inverse=True)
+        for k in range(len(w)):
+            acc[k][cells] += np.bincount(inv, weights=acc[k][src] + w[k][src])
+        indeg[cells] -= np.bincount(inv)
+        wave = cells[indeg[cells] == 0]
+    return acc
+
+
+# last item of the path that starts at each item and follows next_idx (-1 ends the path), found by
+# pointer doubling
+def path_ends(next_idx):
+    ptr = np.where(next_idx >= 0, next_idx, np.arange(len(next_idx)))
+    while np.any(ptr[ptr] != ptr):
+        ptr = ptr[ptr]
+    return ptr
+
+
+# downstream indexes of the cells of one tile: the window of fdir around the tile (with a halo of one
+# cell) is read, and returns the tile-local downstream index of every tile cell (-1 where the flow
+# leaves the tile), the global index of the cell outside the tile that the flow enters (-1 if none,
+# or if the flow stays in the tile), and the valid (directed) cells
+def _tile_flow(fd_path, grid_shape, tile):
+    r0, r1, c0, c1 = tile
+    nrows, ncols = grid_shape
+    fd_mm = np.lib.format.open_memmap(fd_path, mode="r")
+    win = rT.read_window(fd_mm, r0 - 1, r1 + 1, c0 - 1, c1 + 1, 0)
+    del fd_mm
+    h, w = r1 - r0, c1 - c0
+    win_down = downstream(win)
+
+    # window index of every tile cell (row-major), and the tile-local index of every window cell
+    rows, cols = np.indices((h, w))
+    win_idx = ((rows + 1) * (w + 2) + cols + 1).ravel()
+    local = -np.ones(win_down.shape, dtype=np.int64)
+    local[win_idx] = np.arange(h * w)
+
+    d = win_down[win_idx]
+    local_down = np.where(d >= 0, local[np.maximum(d, 0)], -1)
+    leaves = (d >= 0) & (local_down < 0)
+    # global index of the cell the flow enters when it leaves the tile
+    dr = np.maximum(d, 0) // (w + 2)
+    dc = np.maximum(d, 0) % (w + 2)
+    out_idx = np.where(leaves, (r0 - 1 + dr) * ncols + (c0 - 1 + dc), -1)
+    valid = win.ravel()[win_idx] > 0
+    return local_down, out_idx, valid
+
+
+# tile-parallel pass 1: local accumulation of the weights within one tile, written to the local
+# accumulation arrays. Returns the flow that leaves the tile (the global index of the cell it
+# enters and the amount per weight), and for the cells on the border of the tile, the global index
+# of the cell where their flow path leaves the tile.
+def _local_tile(job):
+    fd_path, weight_paths, local_paths, grid_shape, tile = job
+    r0, r1, c0, c1 = tile
+    local_down, out_idx, valid = _tile_flow(fd_path, grid_shape, tile)
+    weights = []
+    for path in weight_paths:
+        if path is None:
+            weights.append(None)
+        else:
+            wt_mm = np.lib.format.open_memmap(path, mode="r")
+            weights.append(np.nan_to_num(np.array(wt_mm[r0:r1, c0:c1], dtype=np.float64)).ravel())
+            del wt_mm
+    acc = accumulate_down(local_down, valid, weights)
+    for path, a in zip(local_paths, acc):
+        out = np.lib.format.open_memmap(path, mode="r+")
+        out[r0:r1, c0:c1] = a.reshape(r1 - r0, c1 - c0)
+        out.flush()
+        del out
+
+    # flow leaving the tile: the total of the cell plus its own weight
+    leaves = np.flatnonzero(out_idx >= 0)
+    amounts = [a[leaves] + (1.0 if wt is None else wt[leaves]) for a, wt in zip(acc, weights)]
+
+    # where the flow path of each border cell leaves the tile
+    h, w = r1 - r0, c1 - c0
+    rows, cols = np.indices((h, w))
+    border = np.flatnonzero(((rows == 0) | (rows == h - 1) | (cols == 0) | (cols == w - 1)).ravel())
+    border_exit = out_idx[path_ends(local_down)[border]]
+    border_global = (r0 + border // w) * grid_shape[1] + c0 + border % w
+    return out_idx[leaves], amounts, border_global, border_exit
+
+
+# tile-parallel pass 2: add the flow entering the tile from other tiles to the local accumulation
+# and write the results. entries holds the global index of the entry cells of the tile and the
+# inflow per weight at each.
+def _offset_tile(job):
+    fd_path, local_paths, out_paths, grid_shape, tile, entry_idx, entry_flow = job
+    r0, r1, c0, c1 = tile
+    h, w = r1 - r0, c1 - c0
+    local_down, out_idx, valid = _tile_flow(fd_path, grid_shape, tile)
+    rows, cols = divmod(np.asarray(entry_idx, dtype=np.int64), grid_shape[1])
+    cells = (rows - r0) * w + cols - c0
+    deltas = []
+    for flow_in in entry_flow:
+        delta = np.zeros(h * w)
+        delta[cells] = flow_in
+        deltas.append(delta)
+    # the inflow reaches the entry cell and every cell downstream of it in the tile
+    passed = accumulate_down(local_down, valid, deltas) if len(cells) else [np.zeros(h * w) for d in deltas]
+    for local_path, out_path, p, delta in zip(local_paths, out_paths, passed, deltas):
+        local_mm = np.lib.format.open_memmap(local_path, mode="r")
+        total = np.array(local_mm[r0:r1, c0:c1], dtype=np.float64).ravel() + p + delta
+        del local_mm
+        total[~valid] = np.nan
+        out = np.lib.format.open_memmap(out_path, mode="r+")
+        out[r0:r1, c0:c1] = total.reshape(h, w)
+        out.flush()
+        del out
+
+
+# tile-parallel version of accumulate for memory-mapped flow direction and weight arrays (.npy
+# paths; None for a unit weight). Each tile is accumulated on its own (in a process pool); the flow
+# that crosses tile borders is then resolved on the small graph of tile entry cells (each entry
+# cell passes its inflow on to the entry cell where its flow path leaves the tile), and a second
+# pass over the tiles adds the inflow to the cells downstream of each entry cell. The results are
+# written as float32 arrays to out_paths.
+def accumulate_tiled(fd_path, weight_paths, out_paths, tile_size, processes=1, scratch=None):
+    fd_mm = np.lib.format.open_memmap(fd_path, mode="r")
+    grid_shape = fd_mm.shape
+    del fd_mm
+    grid = rT.Grid(0.0, 0.0, 1.0, grid_shape[0], grid_shape[1], None)
+    tile_list = rT.tiles(grid, tile_size)
+    scratch = scratch or os.path.dirname(out_paths[0])
+    local_paths = [os.path.join(scratch, "local_acc_" + str(k) + ".npy") for k in range(len(weight_paths))]
+    for path in local_paths:
+        np.lib.format.open_memmap(path, mode="w+", dtype=np.float64, shape=grid_shape)
+
+    jobs = [(fd_path, weight_paths, local_paths, grid_shape, t) for t in tile_list]
+    results = rT.run_jobs(_local_tile, jobs, processes)
+
+    # inter-tile graph: the flow entering each entry cell directly from the neighbouring tile, and
+    # the entry cell that the flow path from each entry cell leads to
+    nw = len(weight_paths)
+    inflow = {}
+    exit_of = {}
+    for entered, amounts, border_global, border_exit in results:
+        for i, cell in enumerate(entered.tolist()):
+            flow_in = inflow.setdefault(cell, [0.0] * nw)
+            for k in range(nw):
+                flow_in[k] += amounts[k][i]
+        exit_of.update(zip(border_global.tolist(), border_exit.tolist()))
+    # pass the inflow along the entry cell graph in topological order
+    indeg = dict((cell, 0) for cell in inflow)
+    for cell in inflow:
+        nxt = exit_of.get(cell, -1)
+        if nxt >= 0:
+            indeg[nxt] += 1
+    queue = collections.deque(cell for cell in inflow if indeg[cell] == 0)
+    while queue:
+        cell = queue.popleft()
+        nxt = exit_of.get(cell, -1)
+        if nxt >= 0:
+            for k in range(nw):
+                inflow[nxt][k] += inflow[cell][k]
+            indeg[nxt] -= 1
+            if indeg[nxt] == 0:
+                queue.append(nxt)
+
+    # second pass: add the inflow of the entry cells of each tile
+    per_tile = dict((t, ([], [[] for k in range(nw)])) for t in tile_list)
+    tile_of = dict(((t[0], t[2]), t) for t in tile_list)
+    tile_size = int(tile_size)
+    for cell, flow_in in inflow.items():
+        r, c = divmod(cell, grid_shape[1])
+        idx, amounts = per_tile[tile_of[(r - r % tile_size, c - c % tile_size)]]
+        idx.append(cell)
+        for k in range(nw):
+            amounts[k].append(flow_in[k])
+    for path in out_paths:
+        np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=grid_shape)
+    jobs = [(fd_path, local_paths, out_paths, grid_shape, t, per_tile[t][0], per_tile[t][1]) for t in tile_list]
+    rT.run_jobs(_offset_tile, jobs, processes)
+    for path in local_paths:
+        os.remove(path)
+    return out_paths
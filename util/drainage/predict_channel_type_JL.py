@@ -6,74 +6,83 @@
 #				ultimate goal of providing information to be used in salmonid habitat modeling.  Much of the code
 #               in this script was derived from code originally written by Hiroo Imaki.
 # author:		Jesse Langdon
-# dependencies: ESRI arcpy module
+# dependencies: ESRI arcpy module, numpy
 
+import collections
 import arcpy
+import numpy as np
+from .. import table_array
 
-def main(input_strm, outFGB):
+# classification thresholds
+#   bfw: bankfull width (m) dividing mountain (small) and floodplain (large) channel types
+#   confinement: floodplain width to bankfull width ratio dividing confined and unconfined channels
+#   slope: log10 of the slope dividing braided channels from the other unconfined types
+#   r_stress: shear stress dividing straight channels from the other unconfined types
+#   a, b: slope and intercept of the line log10(slope) = a * log10(ppt) + b dividing island-braided
+#   and meandering channels
+Thresholds = collections.namedtuple("Thresholds", "bfw confinement slope r_stress a b")
+THRESHOLDS = Thresholds(bfw=8, confinement=3.8, slope=-1.62, r_stress=15, a=-0.61, b=1.15)
 
-    # Add a new field to store the classification types
-    arcpy.AddField_management()
+# slope classes of small streams: the upper slope limit of each class, in increasing order
+SMALL_CLASSES = [(0.015, "pool_riffle"), (0.03, "plane_bed"), (0.065, "step_pool"), (np.inf, "cascade")]
 
-    # Classification threshold settings
-    threshold_bfw = 8 # Divides mountain and floodplain channel types
-    threshold_confinement = 3.8 # Divides confined and unconfined channel types
-    threshold_slope = -1.62 # Divides braided channel from other types
-    threshold_r_stress = 15 # Relative shear stress threshold, splits straight from other types
-    threshold_a = -0.61 # Slope threshold to divide meandering and island-braided
-    threshold_b = 1.15 # Intercept threshold to divide meandering and island-braided
-
-    # determine intermediate values for classification calculations
-    # build lists of values for each parameter
-
-    # Step 1 - split reaches into 'small' and 'large' types
-    small_strm = arcpy.SelectLayerByAttribute_management(input_strm, "NEW_SELECTION", '"bfw_m" <' + str(threshold_bfw))
-    large_strm = arcpy.SelectLayerByAttribute_management(input_strm, "NEW_SELECTION", '"!bfw_m!" <' + str(threshold_bfw))
-    # Step 2 - use data access (da) update cursors for classification of 'small' stream reaches
-    cursor_sm = arcpy.da.UpdateCursor(small_strm, ["Slope", "bfw_m", "bfd_m", "ss", "fpd_m", "channel_type"])
-    for row in cursor_sm:
-        if row[0] < 0.015:
-            row[5] = "pool_riffle"
-        elif (row[0] >= 0.015) and (row[0] < 0.03):
-            row[5] = "plane_bed"
-        elif (row[0] <= 0.03) and (row[0] <0.065):
-            row[5] = "step_pool"
-        elif row[0] >= 0.065:
-            row[5] = "cascade"
-        cursor_sm.updateRow(row)
-        del row
-    del small_strm
-
-    # Step 3 - for 'large' streams, split reaches into 'confined' and 'unconfined'
-    conf_strm = arcpy.SelectLayerByAttribute_management(large_strm, "NEW_SELECTION",
-                                                            '("!fpw_m!"/"!bfw_m!") <' + str(threshold_confinement))
-    arcpy.CalculateField_management(conf_strm, "channel_type", "confined", "PYTHON_9.3")
-    unconf_strm = arcpy.SelectLayerByAttribute_management(large_strm, "NEW_SELECTION",
-                                                              '("!fpw_m!"/"!bfw_m!") >' + str(threshold_confinement))
-    del conf_strm
-    # Step 4 - for unconfined reaches, classify into 4 floodplain stream stypes
-    # Step 4a - split based on shear stress
-    unconf_strm_straight = arcpy.SelectLayerByAttribute_management(unconf_strm, "NEW_SELECTION", '"!ss!" >' + str(threshold_r_stress))
-    unconf_strm_curved = arcpy.SelectLayerByAttribute_management(unconf_strm, "NEW_SELECTION", '"!ss!" <' + str(threshold_r_stress))
-    arcpy.CalculateField_management(unconf_strm_straight, "channel_type", "straight", "PYTHON_9.3")
-    del unconf_strm_straight
-    # Step 4b - classify reaches with slope greater than 0.4 as 'braided'
-    unconf_strm_braid = arcpy.SelectLayerByAttribute_management(unconf_strm_curved, "NEW_SELECTION", '(log10("!slope!")) >' + str(threshold_slope))
-    unconf_strm_other = arcpy.SelectLayerByAttribute_management(unconf_strm_curved, "NEW_SELECTION", '(log10("!slope!")) <' + str(threshold_slope))
-    arcpy.CalculateField_management(unconf_strm_braid, "channel_type", "braided", "PYTHON_9.3")
-    del unconf_strm_braid
-    # Step 4c - split remaining reaches into 'island-braided' and 'meandering'
-    unconf_strm_isl_braid = arcpy.SelectLayerByAttribute_management(unconf_strm_other, "NEW_SELECTION",
-                                                                    '(log10("!slope!")) > (' + str(threshold_a) + '* (log10("!ppt!") + ' + str(threshold_b))
-    unconf_strm_meander = arcpy.SelectLayerByAttribute_management(unconf_strm_other, "NEW_SELECTION",
-                                                                  '(log10("!slope!")) <= (' + str(threshold_a) + '* (log10("!ppt!") + ' + str(threshold_b))
-    arcpy.CalculateField_management(unconf_strm_isl_braid, "channel_type", "island_braided", "PYTHON_9.3")
-    arcpy.CalculateField_management(unconf_strm_meander, "channel_type", "meandering", "PYTHON_9.3")
-    del unconf_strm_isl_braid
-    del unconf_strm_meander
 
+# channel type of every segment from arrays of bankfull width, floodplain width, shear stress, slope
+# and precipitation, following the decision tree of Beechie and Imaki (2014). Returns an object
+# array of type names, with None where an input needed for a segment's branch of the tree is null.
+def classify(bfw, fpw, ss, slope, ppt, thresholds=THRESHOLDS):
+    bfw, fpw, ss, slope, ppt = [np.asarray(v, dtype=np.float64) for v in (bfw, fpw, ss, slope, ppt)]
+    out = np.empty(len(bfw), dtype=object)
+    out[...] = None
+    known = ~np.isnan(bfw)
 
+    # small streams: classes by slope
+    small = known & ~np.isnan(slope)
+    small[small] = bfw[small] < thresholds.bfw
+    upper = np.array([limit for limit, name in SMALL_CLASSES])
+    names = np.array([name for limit, name in SMALL_CLASSES], dtype=object)
+    out[small] = names[np.searchsorted(upper, slope[small], side="right")]
 
+    # large streams: confined or unconfined
+    large = known & (np.where(known, bfw, 0.0) >= thresholds.bfw) & ~np.isnan(fpw)
+    ratio = np.where(large, fpw, 0.0) / np.where(large, bfw, 1.0)
+    confined = large & (ratio < thresholds.confinement)
+    out[confined] = "confined"
+    unconfined = large & ~confined
 
+    # unconfined streams: straight by shear stress, then braided by slope, then island-braided or
+    # meandering by slope and precipitation. Flat or adverse slopes count as the lowest slope.
+    unconfined &= ~np.isnan(ss) & ~np.isnan(slope)
+    straight = unconfined & (np.where(unconfined, ss, 0.0) > thresholds.r_stress)
+    out[straight] = "straight"
+    curved = unconfined & ~straight
+    log_slope = np.empty(len(bfw))
+    log_slope[...] = -np.inf
+    steep = curved & (np.where(curved, slope, 0.0) > 0)
+    log_slope[steep] = np.log10(slope[steep])
+    braided = curved & (log_slope > thresholds.slope)
+    out[braided] = "braided"
+    other = curved & ~braided & ~np.isnan(ppt)
+    other[other] = ppt[other] > 0
+    island = np.zeros(len(bfw), dtype=bool)
+    island[other] = log_slope[other] > thresholds.a * np.log10(ppt[other]) + thresholds.b
+    out[island] = "island_braided"
+    out[other & ~island] = "meandering"
+    return out
 
 
+# classify every segment of input_strm and write the channel types to the "channel_type" field in
+# one pass. fpw_field names the floodplain width field, which no stage of the NCC Tool computes, so
+# it has to be added to input_strm beforehand; missing input fields raise a ValueError.
+def main(input_strm, outFGB, thresholds=THRESHOLDS, fpw_field="fpw_m"):
+    arcpy.AddMessage("Predicting channel types...")
+    fields = ["bfw_m", fpw_field, "ss", "Slope", "ppt"]
+    names = [f.name.lower() for f in arcpy.ListFields(input_strm)]
+    missing = [f for f in fields if f.lower() not in names]
+    if missing:
+        raise ValueError(input_strm + " is missing the field(s) " + ", ".join(missing) + " needed to predict "
+                         "channel types (" + fpw_field + " is the floodplain width, in meters)")
+    cols = table_array.read_columns(input_strm, fields, null_value=dict((f, np.nan) for f in fields))
+    channel_type = classify(cols["bfw_m"], cols[fpw_field], cols["ss"], cols["Slope"], cols["ppt"], thresholds)
+    table_array.write_columns(input_strm, cols["OID@"], {"channel_type": channel_type})
+    return input_strm
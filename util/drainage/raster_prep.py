@@ -3,29 +3,48 @@
 #				then calculates flow direction and flow accumulation using the preprocessed
 #				elevation data.  The resulting raster datasets can serve as inputs for
 #				other tools that calculate drainage area, slope, and precipitation per
-#				drainage basin.  		  
+#				drainage basin.  The DEM is masked and smoothed by the tiled raster engine
+#				(raster_tile.py) in blocks of tile_size x tile_size cells, optionally spread over
+#				several processes.  Depressions are filled with the priority-flood fill in fill.py, in
+#				memory with an epsilon gradient, or tile by tile for DEMs of more than max_cells cells.
+#				Flow directions are computed by flow.py, which holds the whole DEM in memory, so larger
+#				DEMs use the Spatial Analyst FlowDirection tool (which also drains the flats).  The
+#				unweighted and precipitation-weighted flow accumulation are computed together, tile by
+#				tile, by flow.accumulate_tiled, which keeps only one tile of each raster in memory.
 # author:		Jesse Langdon
-# dependencies: ESRI arcpy module, Spatial Analyst extension
+# dependencies: ESRI arcpy module, Spatial Analyst extension, numpy
 
-import os, sys, arcpy
+import os, sys, shutil, tempfile, arcpy
 from arcpy.sa import *
+import numpy as np
+import raster_tile as rT
+import fill as pF
+import flow as fW
 
 # define preprocess DEM function
-def raster_prep(in_dem, in_huc, input_ppt, outFGB):
+def raster_prep(in_dem, in_huc, input_ppt, outFGB, tile_size=2048, processes=1, smooth_radius=5,
+				max_cells=50000000, fill_epsilon=0.0001):
 	arcpy.AddMessage("Preprocessing the DEM...")
-	arcpy.MakeRasterLayer_management(in_dem, r"in_dem_lyr")
 	arcpy.MakeFeatureLayer_management(in_huc, r"in_huc_lyr")
-	dem_clip = ExtractByMask(r"in_dem_lyr", r"in_huc_lyr")
-	dem_smooth = FocalStatistics(dem_clip, NbrCircle(5, "CELL"))
-	dem_fill = Fill(dem_smooth, "#")
-	dem_fill.save(outFGB + "\\dem_fill")
+	# mask the DEM to the HUC and smooth it (circular focal mean, radius of smooth_radius cells), tile by tile
+	scratch = tempfile.mkdtemp()
+	grid = rT.grid_of(in_dem, arcpy.Describe(in_huc).extent)
+	dem = rT.read_raster(in_dem, grid, os.path.join(scratch, "dem.npy"), tile_size)
+	mask = rT.polygon_mask(in_huc, in_dem, grid, os.path.join(scratch, "mask.npy"), tile_size)
+	smooth = rT.apply_tiled(rT.masked_focal_mean, [dem, mask], os.path.join(scratch, "dem_smooth.npy"),
+							grid, tile_size, halo=int(smooth_radius), args=(smooth_radius,), processes=processes)
 
-	# create flow rasters
-	arcpy.AddMessage("Calculating flow direction and accumulation...")
-	fd = FlowDirection(dem_fill, "NORMAL")
-	fd.save(outFGB + "\\flow_dir")
-	fa = FlowAccumulation(fd)
-	fa.save(outFGB + "\\flow_acc")
+	# fill depressions (priority-flood). DEMs of up to max_cells cells are filled in memory, in float64
+	# so that the fill_epsilon gradient across filled depressions survives for flow.d8_direction;
+	# larger DEMs are filled tile by tile, spread over the worker processes
+	arcpy.AddMessage("Filling depressions in the DEM...")
+	filled = os.path.join(scratch, "dem_fill.npy")
+	large = grid.nrows * grid.ncols > max_cells
+	if large:
+		pF.fill_tiled(smooth, filled, tile_size, processes)
+	else:
+		np.save(filled, pF.fill(np.load(smooth).astype(np.float64), fill_epsilon))
+	dem_fill = rT.write_raster(filled, grid, outFGB + "\\dem_fill", tile_size)
 
 	# set raster environment parameters
 	arcpy.env.extent = outFGB + "\\dem_fill"
@@ -41,13 +60,35 @@ def raster_prep(in_dem, in_huc, input_ppt, outFGB):
 	ppt_clip = ExtractByMask("in_ppt_lyr", "huc_buf_lyr" )
 	ppt_clip.save(outFGB + "\\ppt_clip")
 	arcpy.MakeRasterLayer_management(outFGB + "\\ppt_clip", "ppt_clip_lyr")
-	arcpy.Resample_management("ppt_clip_lyr", outFGB + "\\ppt_resmp", "10", "BILINEAR")
+	arcpy.Resample_management("ppt_clip_lyr", outFGB + "\\ppt_resmp", str(grid.cell), "BILINEAR")
 	ppt = outFGB + "\\ppt_resmp"
 
+	# create flow rasters: flow direction, then the unweighted (flow_acc) and precipitation-weighted
+	# (fa_wt) flow accumulation in a single traversal of the flow directions. flow.d8_direction holds
+	# the whole DEM in memory, so above max_cells the Spatial Analyst FlowDirection tool is used and
+	# its output read into a memory-mapped array. The accumulation always runs tile by tile, with the
+	# flow between tiles resolved after the local pass.
+	arcpy.AddMessage("Calculating flow direction and accumulation...")
+	fd_npy = os.path.join(scratch, "flow_dir.npy")
+	if large:
+		FlowDirection(dem_fill, "NORMAL").save(outFGB + "\\flow_dir")
+		fd = outFGB + "\\flow_dir"
+		rT.read_raster(fd, grid, fd_npy, tile_size, np.uint8, 0)
+	else:
+		np.save(fd_npy, fW.d8_direction(np.load(filled)))
+		fd = rT.write_raster(fd_npy, grid, outFGB + "\\flow_dir", tile_size, "8_BIT_UNSIGNED", 0)
+	ppt_npy = rT.read_raster(ppt, grid, os.path.join(scratch, "ppt.npy"), tile_size)
+	fW.accumulate_tiled(fd_npy, [None, ppt_npy],
+						[os.path.join(scratch, "flow_acc.npy"), os.path.join(scratch, "fa_wt.npy")],
+						tile_size, processes, scratch)
+	fa = rT.write_raster(os.path.join(scratch, "flow_acc.npy"), grid, outFGB + "\\flow_acc", tile_size)
+	fa_wt = rT.write_raster(os.path.join(scratch, "fa_wt.npy"), grid, outFGB + "\\fa_wt", tile_size)
+	shutil.rmtree(scratch, ignore_errors=True)
+
 	# temp file clean up
 	arcpy.Delete_management("in_ppt_lyr")
 	arcpy.Delete_management("in_huc_lyr")
 	arcpy.Delete_management("ppt_clip_lyr")
 	arcpy.Delete_management(outFGB + "\\ppt_clip")
 
-	return (fd, fa, ppt, dem_fill)
\ No newline at end of file
+	return (fd, fa, ppt, dem_fill, fa_wt)
\ No newline at end of file
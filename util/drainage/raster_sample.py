@@ -0,0 +1,197 @@
+# file name:	raster_sample.py
+# description:	Helper functions for sampling raster values at point locations with NumPy, instead of
+#				buffering the points and running zonal statistics.  Point coordinates are converted to
+#				row and column indexes of the raster cells, and the cells around every point are
+#				gathered at once with fancy indexing.  Elevations along lines and at points are
+#				interpolated bilinearly from the four surrounding cell centres in the same way.
+#				Points are grouped by square blocks of BLOCK_CELLS cells and a raster window is read
+#				per block, and the cells around the points are gathered at most MAX_CANDIDATES at a
+#				time, so memory does not grow with the extent of the points or the cell size.
+# author:		Jesse Langdon
+# dependencies: ESRI arcpy module, numpy
+
+import math
+import arcpy
+import numpy as np
+from .. import line_array
+
+# side of the blocks that points are grouped by, in cells (the window read for a block covers at
+# most this many cells per side, plus the search radius)
+BLOCK_CELLS = 2048
+# number of candidate cells gathered at once when searching around points
+MAX_CANDIDATES = 1000000
+# number of samples taken along lines at once (see mean_along_lines)
+MAX_SAMPLES = 1000000
+
+
+# read the part of a raster that covers the points xy plus a margin (and one more cell), as a float
+# array with NoData as NaN. Returns the array, the x coordinate of its left edge, the y coordinate
+# of its top edge and the cell size.
+def read_window(in_raster, xy, margin):
+    d = arcpy.Describe(in_raster)
+    cell = float(d.meanCellWidth)
+    ext = d.extent
+    margin += cell
+    # the window is snapped to the raster cells and kept within the raster
+    c0 = max(int(math.floor((xy[:, 0].min() - margin - ext.XMin) / cell)), 0)
+    c1 = min(int(math.ceil((xy[:, 0].max() + margin - ext.XMin) / cell)), int(d.width))
+    r0 = max(int(math.floor((ext.YMax - xy[:, 1].max() - margin) / cell)), 0)
+    r1 = min(int(math.ceil((ext.YMax - xy[:, 1].min() + margin) / cell)), int(d.height))
+    x_min = ext.XMin + c0 * cell
+    y_max = ext.YMax - r0 * cell
+    if c1 <= c0 or r1 <= r0:
+        return np.zeros((0, 0)), x_min, y_max, cell
+    corner = arcpy.Point(x_min, ext.YMax - r1 * cell)
+    arr = arcpy.RasterToNumPyArray(in_raster, corner, c1 - c0, r1 - r0, np.nan).astype(np.float64)
+    return arr, x_min, y_max, cell
+
+
+# indexes of the points of xy grouped by square blocks of block_size map units, one array per
+# occupied block (ordered by block row, then column), so that the raster window around the points
+# of each block stays small
+def point_blocks(xy, block_size):
+    bx = np.floor(xy[:, 0] / block_size).astype(np.int64)
+    by = np.floor(-xy[:, 1] / block_size).astype(np.int64)
+    order = np.lexsort((bx, by))
+    new = (np.diff(bx[order]) != 0) | (np.diff(by[order]) != 0)
+    bounds = np.concatenate(([0], np.flatnonzero(new) + 1, [len(xy)]))
+    return [order[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+# number of points whose candidate cells (see nearby_cells) add up to about MAX_CANDIDATES
+def points_per_chunk(cell, radius):
+    k = int(math.ceil(radius / cell)) + 1
+    return max(MAX_CANDIDATES // (2 * k + 1) ** 2, 1)
+
+
+# candidate cells around each point: the (row, column) of the cells of a square around the cell of
+# each point, and whether each is inside the array with its centre within radius of the point
+def nearby_cells(shape, x_min, y_max, cell, pts, radius):
+    nrows, ncols = shape
+    k = int(math.ceil(radius / cell)) + 1
+    dy, dx = np.mgrid[-k:k + 1, -k:k + 1]
+    row = np.floor((y_max - pts[:, 1]) / cell).astype(np.int64)
+    col = np.floor((pts[:, 0] - x_min) / cell).astype(np.int64)
+    rows = row[:, np.newaxis] + dy.ravel()
+    cols = col[:, np.newaxis] + dx.ravel()
+    cx = x_min + (cols + 0.5) * cell
+    cy = y_max - (rows + 0.5) * cell
+    near = ((cx - pts[:, 0:1]) ** 2 + (cy - pts[:, 1:2]) ** 2 <= radius ** 2)
+    near &= (rows >= 0) & (rows < nrows) & (cols >= 0) & (cols < ncols)
+    return np.clip(rows, 0, nrows - 1), np.clip(cols, 0, ncols - 1), near
+
+
+# maximum of each raster within radius of each point: the cells whose centres are within radius (map
+# units) of the point, as ZonalStatisticsAsTable MAXIMUM over a buffer of the point. NoData cells
+# are ignored, and points with no data in range get NaN. Returns one array per raster, in the
+# order of the points. A window of the raster is read for each block of points (see point_blocks).
+def max_in_radius(in_rasters, xy, radius):
+    xy = np.asarray(xy, dtype=np.float64)
+    results = []
+    for in_raster in in_rasters:
+        out = np.empty(len(xy))
+        out[...] = np.nan
+        results.append(out)
+        if len(xy) == 0:
+            continue
+        cell = float(arcpy.Describe(in_raster).meanCellWidth)
+        for idx in point_blocks(xy, BLOCK_CELLS * cell):
+            arr, x_min, y_max, cell = read_window(in_raster, xy[idx], radius)
+            if arr.size == 0:
+                continue
+            best = argmax_in_radius(arr, x_min, y_max, cell, xy[idx], radius)
+            found = best >= 0
+            out[idx[found]] = arr.ravel()[best[found]]
+    return results
+
+
+# flat index of the cell of arr with the largest value within radius of each point (e.g. a pour
+# point snapped to the highest flow accumulation), or -1 where no cell in range has data. The array
+# covers the cells right of x_min and below y_max. The points are searched in chunks of about
+# MAX_CANDIDATES candidate cells.
+def argmax_in_radius(arr, x_min, y_max, cell, xy, radius):
+    xy = np.asarray(xy, dtype=np.float64)
+    out = -np.ones(len(xy), dtype=np.int64)
+    chunk_size = points_per_chunk(cell, radius)
+    for first in range(0, len(xy), chunk_size):
+        rows, cols, near = nearby_cells(arr.shape, x_min, y_max, cell, xy[first:first + chunk_size], radius)
+        vals = np.array(arr[rows, cols], dtype=np.float64)
+        vals[~near | np.isnan(vals)] = -np.inf
+        best = vals.argmax(axis=1)
+        pick = np.arange(len(best))
+        found = ~np.isinf(vals[pick, best])
+        out[first:first + chunk_size] = np.where(found, rows[pick, best] * arr.shape[1] + cols[pick, best], -1)
+    return out
+
+
+# bilinear interpolation of arr at the points xy, from the four cell centres around each point
+# (as AddSurfaceInformation with BILINEAR). The array covers the cells right of x_min and below
+# y_max. NoData (NaN) cells and cells past the edge are left out and the weights of the others are
+# scaled up; points with none of the four cells get NaN.
+def bilinear(arr, x_min, y_max, cell, xy):
+    xy = np.asarray(xy, dtype=np.float64)
+    nrows, ncols = arr.shape
+    fx = (xy[:, 0] - x_min) / cell - 0.5
+    fy = (y_max - xy[:, 1]) / cell - 0.5
+    c0 = np.floor(fx).astype(np.int64)
+    r0 = np.floor(fy).astype(np.int64)
+    tx = fx - c0
+    ty = fy - r0
+    total = np.zeros(len(xy))
+    weight = np.zeros(len(xy))
+    for dr, dc, w in ((0, 0, (1 - ty) * (1 - tx)), (0, 1, (1 - ty) * tx),
+                      (1, 0, ty * (1 - tx)), (1, 1, ty * tx)):
+        r = r0 + dr
+        c = c0 + dc
+        vals = arr[np.clip(r, 0, nrows - 1), np.clip(c, 0, ncols - 1)]
+        ok = (r >= 0) & (r < nrows) & (c >= 0) & (c < ncols) & ~np.isnan(vals)
+        total += np.where(ok, w * np.nan_to_num(vals), 0.0)
+        weight += np.where(ok, w, 0.0)
+    out = np.empty(len(xy))
+    out[...] = np.nan
+    has_data = weight > 0
+    out[has_data] = total[has_data] / weight[has_data]
+    return out
+
+
+# bilinear values of a raster at the points xy, from one raster window per block of points (see
+# point_blocks)
+def sample_bilinear(in_raster, xy):
+    xy = np.asarray(xy, dtype=np.float64)
+    out = np.empty(len(xy))
+    out[...] = np.nan
+    if len(xy) == 0:
+        return out
+    cell = float(arcpy.Describe(in_raster).meanCellWidth)
+    for idx in point_blocks(xy, BLOCK_CELLS * cell):
+        arr, x_min, y_max, cell = read_window(in_raster, xy[idx], 0.0)
+        if arr.size:
+            out[idx] = bilinear(arr, x_min, y_max, cell, xy[idx])
+    return out
+
+
+# mean raster value along each line (as AddSurfaceInformation with Z_MEAN): the lines are sampled
+# at points no more than one cell apart (see line_array.densify), every sample is interpolated with
+# bilinear, and the samples are averaged per line. The lines are densified in chunks of about
+# MAX_SAMPLES samples. Samples without data are left out; lines without any get NaN.
+def mean_along_lines(in_raster, xy, offsets, spacing=None):
+    n = len(offsets) - 1
+    out = np.empty(n)
+    out[...] = np.nan
+    if n == 0:
+        return out
+    if spacing is None:
+        spacing = float(arcpy.Describe(in_raster).meanCellWidth)
+    # samples taken along each line (see line_array.densify), as a running total
+    samples = np.cumsum(np.maximum(np.ceil(line_array.line_length(xy, offsets) / spacing), 1))
+    bounds = np.searchsorted(samples, np.arange(MAX_SAMPLES, samples[-1], MAX_SAMPLES))
+    bounds = np.unique(np.concatenate(([0], np.maximum(bounds, 1), [n])))
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        pts, line_idx = line_array.densify(*line_array.slice_lines(xy, offsets, start, stop), spacing=spacing)
+        vals = sample_bilinear(in_raster, pts)
+        ok = ~np.isnan(vals)
+        total = np.bincount(line_idx[ok], weights=vals[ok], minlength=stop - start)
+        count = np.bincount(line_idx[ok], minlength=stop - start)
+        has_data = np.flatnonzero(count > 0)
+        out[start + has_data] = total[has_data] / count[has_data]
+    return out
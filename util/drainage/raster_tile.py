@@ -0,0 +1,232 @@
+# file name:	raster_tile.py
+# description:	Block-tiled raster engine for the NCC Tool raster preprocessing.  Rasters are copied into
+#				memory-mapped .npy files one window at a time (RasterToNumPyArray with a lower left
+#				corner and size), so a DEM never has to fit in memory.  Block operations are applied
+#				tile by tile: each tile is read with a halo of extra cells wide enough for the operation
+#				(e.g. the radius of a focal window), and only the tile interior is written to the output,
+#				so the results stitch without seams.  Tiles can be processed by a pool of worker
+#				processes, which open the same memory-mapped files.  Results are written back to a raster
+#				one tile at a time (NumPyArrayToRaster, then MosaicToNewRaster).
+# author:		Jesse Langdon
+# dependencies: ESRI arcpy module, numpy
+
+import os, sys, math, shutil, tempfile, collections
+import multiprocessing
+import arcpy
+import numpy as np
+
+# value written to output rasters for NaN cells (the ESRI default NoData value of float rasters)
+NODATA = -3.4028235e38
+
+# cell grid of a raster window: upper left corner, cell size, number of rows and columns and the
+# spatial reference
+Grid = collections.namedtuple("Grid", "x_min y_max cell nrows ncols sr")
+
+
+# cell grid of a raster, optionally limited to the cells that cover an extent
+def grid_of(in_raster, extent=None):
+    d = arcpy.Describe(in_raster)
+    cell = float(d.meanCellWidth)
+    x_min = d.extent.XMin
+    y_max = d.extent.YMax
+    nrows = int(d.height)
+    ncols = int(d.width)
+    if extent is not None:
+        # snap the extent outward to the raster cells, and keep it within the raster
+        c0 = max(int(math.floor((extent.XMin - x_min) / cell)), 0)
+        c1 = min(int(math.ceil((extent.XMax - x_min) / cell)), ncols)
+        r0 = max(int(math.floor((y_max - extent.YMax) / cell)), 0)
+        r1 = min(int(math.ceil((y_max - extent.YMin) / cell)), nrows)
+        x_min += c0 * cell
+        y_max -= r0 * cell
+        nrows = r1 - r0
+        ncols = c1 - c0
+    return Grid(x_min, y_max, cell, nrows, ncols, d.spatialReference)
+
+
+# arcpy extent of a grid
+def grid_extent(grid):
+    return arcpy.Extent(grid.x_min, grid.y_max - grid.nrows * grid.cell,
+                        grid.x_min + grid.ncols * grid.cell, grid.y_max)
+
+
+# (first row, end row, first column, end column) of every tile of a grid
+def tiles(grid, tile_size):
+    tile_size = int(tile_size)
+    return [(r0, min(r0 + tile_size, grid.nrows), c0, min(c0 + tile_size, grid.ncols))
+            for r0 in range(0, grid.nrows, tile_size) for c0 in range(0, grid.ncols, tile_size)]
+
+
+# lower left corner of a window of the grid
+def lower_left(grid, r1, c0):
+    return arcpy.Point(grid.x_min + c0 * grid.cell, grid.y_max - r1 * grid.cell)
+
+
+# copy a raster into a new memory-mapped array file (.npy) on the cells of grid, one tile at a time.
+# NoData cells are read as nodata (NaN by default, for float arrays).
+def read_raster(in_raster, grid, path, tile_size, dtype=np.float32, nodata=np.nan):
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(grid.nrows, grid.ncols))
+    for r0, r1, c0, c1 in tiles(grid, tile_size):
+        block = arcpy.RasterToNumPyArray(in_raster, lower_left(grid, r1, c0), c1 - c0, r1 - r0, nodata)
+        out[r0:r1, c0:c1] = block
+    out.flush()
+    del out
+    return path
+
+
+# rasterize polygons onto the cells of grid (cells with their centre inside a polygon) and store the
+# result as a memory-mapped boolean mask; snap_raster is the raster the grid was taken from. The
+# polygons are rasterized by OID, which starts at 0 for shapefiles, so the cells are read with a
+# NoData value of -1 and every cell with an OID is in the mask.
+def polygon_mask(in_poly, snap_raster, grid, path, tile_size):
+    env_extent = arcpy.env.extent
+    env_snap = arcpy.env.snapRaster
+    arcpy.env.extent = grid_extent(grid)
+    arcpy.env.snapRaster = snap_raster
+    oid_field = arcpy.Describe(in_poly).OIDFieldName
+    arcpy.PolygonToRaster_conversion(in_poly, oid_field, r"in_memory\poly_mask", "CELL_CENTER", "", grid.cell)
+    arcpy.env.extent = env_extent
+    arcpy.env.snapRaster = env_snap
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=np.bool_, shape=(grid.nrows, grid.ncols))
+    for r0, r1, c0, c1 in tiles(grid, tile_size):
+        block = arcpy.RasterToNumPyArray(r"in_memory\poly_mask", lower_left(grid, r1, c0), c1 - c0, r1 - r0, -1)
+        out[r0:r1, c0:c1] = block >= 0
+    out.flush()
+    del out
+    arcpy.Delete_management(r"in_memory\poly_mask")
+    return path
+
+
+# read a window of an array, padded with fill wherever the window extends past the array
+def read_window(arr, r0, r1, c0, c1, fill):
+    out = np.empty((r1 - r0, c1 - c0), dtype=arr.dtype)
+    out[...] = fill
+    rr0 = max(r0, 0)
+    rr1 = min(r1, arr.shape[0])
+    cc0 = max(c0, 0)
+    cc1 = min(c1, arr.shape[1])
+    if rr1 > rr0 and cc1 > cc0:
+        out[rr0 - r0:rr1 - r0, cc0 - c0:cc1 - c0] = arr[rr0:rr1, cc0:cc1]
+    return out
+
+
+# process one tile: read the source windows with their halo, apply func and write the interior
+def _run_tile(job):
+    func, args, src_paths, dst_path, (r0, r1, c0, c1), halo = job
+    blocks = []
+    for path in src_paths:
+        src = np.lib.format.open_memmap(path, mode="r")
+        fill = np.nan if src.dtype.kind == "f" else 0
+        blocks.append(read_window(src, r0 - halo, r1 + halo, c0 - halo, c1 + halo, fill))
+        del src
+    result = func(*(blocks + list(args)))
+    dst = np.lib.format.open_memmap(dst_path, mode="r+")
+    dst[r0:r1, c0:c1] = result[halo:halo + r1 - r0, halo:halo + c1 - c0]
+    dst.flush()
+    del dst
+
+
+# apply func tile by tile to the memory-mapped arrays in src_paths and store the result in a new
+# memory-mapped array at dst_path. func is called as func(block_1, ..., block_n, *args) with blocks
+# that include halo extra cells on every side (NaN or 0 past the edge of the grid), and returns an
+# array of the same shape. func must be a module level function so that it can be sent to the
+# worker processes when processes > 1.
+def apply_tiled(func, src_paths, dst_path, grid, tile_size, halo=0, args=(), processes=1, dtype=np.float32):
+    dst = np.lib.format.open_memmap(dst_path, mode="w+", dtype=dtype, shape=(grid.nrows, grid.ncols))
+    del dst
+    jobs = [(func, tuple(args), list(src_paths), dst_path, t, int(halo)) for t in tiles(grid, tile_size)]
+    run_jobs(_run_tile, jobs, processes)
+    return dst_path
+
+
+# run func on every job, in a pool of worker processes when processes > 1, and return the results
+# in job order. func must be a module level function.
+def run_jobs(func, jobs, processes=1):
+    if processes > 1 and len(jobs) > 1:
+        # inside ArcMap sys.executable is the application, not the python interpreter
+        if sys.platform == "win32":
+            multiprocessing.set_executable(os.path.join(sys.exec_prefix, "python.exe"))
+        pool = multiprocessing.Pool(processes)
+        try:
+            return pool.map(func, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    return [func(job) for job in jobs]
+
+
+# write a memory-mapped array to a new raster, one tile at a time. NaN cells of float arrays are
+# written as NoData; for integer arrays, cells equal to nodata are.
+def write_raster(src_path, grid, out_raster, tile_size, pixel_type="32_BIT_FLOAT", nodata=0):
+    src = np.lib.format.open_memmap(src_path, mode="r")
+    scratch = tempfile.mkdtemp()
+    tile_rasters = []
+    for i, (r0, r1, c0, c1) in enumerate(tiles(grid, tile_size)):
+        block = np.array(src[r0:r1, c0:c1])
+        if block.dtype.kind == "f":
+            block = block.astype(np.float32)
+            block[np.isnan(block)] = NODATA
+            ras = arcpy.NumPyArrayToRaster(block, lower_left(grid, r1, c0), grid.cell, grid.cell, NODATA)
+        else:
+            ras = arcpy.NumPyArrayToRaster(block, lower_left(grid, r1, c0), grid.cell, grid.cell, nodata)
+        tile_raster = os.path.join(scratch, "tile_" + str(i) + ".tif")
+        ras.save(tile_raster)
+        tile_rasters.append(tile_raster)
+    del src
+    out_path, out_name = os.path.split(out_raster)
+    arcpy.MosaicToNewRaster_management(";".join(tile_rasters), out_path, out_name, grid.sr, pixel_type,
+                                       grid.cell, 1, "FIRST")
+    for tile_raster in tile_rasters:
+        arcpy.Delete_management(tile_raster)
+    shutil.rmtree(scratch, ignore_errors=True)
+    return out_raster
+
+
+# half width of each row of a circular neighbourhood: row dy covers the cells dx = -w .. w with
+# w = floor(sqrt(radius^2 - dy^2)), i.e. the cells whose centres are within radius cells of the
+# centre cell, as in NbrCircle(radius, "CELL")
+def circle_spans(radius):
+    r = int(radius)
+    return [(dy, int(math.floor(math.sqrt(radius ** 2 - dy ** 2)))) for dy in range(-r, r + 1)]
+
+
+# mean of the cells within a circular neighbourhood, ignoring NaN cells (FocalStatistics MEAN with
+# DATA): cells with no data in their neighbourhood are NaN. The circle is split into one horizontal
+# span per row, and each span is summed from row-wise prefix sums of the values and of the count of
+# valid cells, so the cost per cell grows with the radius rather than with the circle area. The
+# block must carry a halo of at least radius cells; cells within radius of the block edge are not
+# valid.
+def focal_mean_circle(values, radius):
+    r = int(radius)
+    nrows, ncols = values.shape
+    valid = ~np.isnan(values)
+    # prefix sums along the rows, with r + 1 zero columns before and r after the data, so that
+    # S[:, j + r + 1] is the sum of the first j + 1 cells of the row
+    sums = np.zeros((nrows, ncols + 2 * r + 1))
+    sums[:, r + 1:r + 1 + ncols] = np.where(valid, values, 0.0)
+    sums = np.cumsum(sums, axis=1)
+    counts = np.zeros((nrows, ncols + 2 * r + 1))
+    counts[:, r + 1:r + 1 + ncols] = valid
+    counts = np.cumsum(counts, axis=1)
+
+    total = np.zeros(values.shape)
+    count = np.zeros(values.shape)
+    for dy, w in circle_spans(radius):
+        # rows of the span (source) for each row of cells (destination)
+        rs = slice(max(dy, 0), nrows + min(dy, 0))
+        rd = slice(max(-dy, 0), nrows + min(-dy, 0))
+        # sum of the cells j - w .. j + w of the source row, for every column j
+        total[rd] += sums[rs, r + 1 + w:r + 1 + w + ncols] - sums[rs, r - w:r - w + ncols]
+        count[rd] += counts[rs, r + 1 + w:r + 1 + w + ncols] - counts[rs, r - w:r - w + ncols]
+    out = np.empty(values.shape)
+    out[...] = np.nan
+    # counts are whole numbers, so a count above 0.5 means at least one valid cell
+    has_data = count > 0.5
+    out[has_data] = total[has_data] / count[has_data]
+    return out
+
+
+# DEM smoothing block operation for raster_prep: mask the DEM to the HUC (ExtractByMask), then take
+# the circular focal mean of the masked values
+def masked_focal_mean(dem, mask, radius):
+    return focal_mean_circle(np.where(mask, dem, np.nan), radius)
@@ -0,0 +1,122 @@
+# file name:	watershed.py
+# description:	Drainage area and precipitation per stream segment from segment watersheds, as an
+#				alternative to sampling the flow accumulation rasters around each segment endpoint.
+#				The pour point of every segment is snapped to the cell of highest flow accumulation
+#				nearby, and every cell of the flow direction grid is labelled with the first pour point
+#				downstream of it (pointer doubling over the downstream cell indexes), so each cell is
+#				counted in exactly one segment's incremental watershed.  Incremental totals are summed
+#				per label with np.bincount, and the downstream segment of each segment (the label of the
+#				cell below its pour point) gives the segment network, over which the totals are
+#				accumulated in topological order.  Once the cells are labelled, a new weight raster
+#				takes one bincount, and the upstream totals depend only on the number of segments:
+#				label_watersheds returns the labelling, and point_totals can be called on it for any
+#				number of weight rasters.
+# author:		Jesse Langdon
+# dependencies: ESRI arcpy module, numpy
+
+import collections
+import arcpy
+import numpy as np
+import flow
+import raster_tile as rT
+import raster_sample as rS
+
+# labelled watersheds of a set of points (see label_watersheds): the cell grid, the label of every
+# cell, the downstream pour point of every pour point, the flat cell index of every pour point, the
+# pour point of every snapped point and which points were snapped
+Watersheds = collections.namedtuple("Watersheds", "grid labels ds pour_cells node found")
+
+
+# read a raster onto the cells of grid as a float64 array, with NoData as NaN
+def read_grid(in_raster, grid):
+    arr = arcpy.RasterToNumPyArray(in_raster, rT.lower_left(grid, grid.nrows, 0), grid.ncols, grid.nrows, np.nan)
+    return arr.astype(np.float64)
+
+
+# label every cell with the index of the first pour point downstream of it (the pour point itself
+# included), or -1 for cells that drain off the grid without passing a pour point. down holds the
+# flat downstream index of every cell (see flow.downstream) and pour_cells the flat cell index of
+# each pour point (all distinct).
+def label_cells(down, pour_cells):
+    seed = -np.ones(len(down), dtype=np.int64)
+    seed[pour_cells] = np.arange(len(pour_cells))
+    # flow paths end at the pour points, so the end of each path is the pour point the cell drains to
+    ends = flow.path_ends(np.where(seed >= 0, -1, down))
+    return seed[ends]
+
+
+# index of the pour point downstream of each pour point (-1 for outlets), from the label of the cell
+# that each pour point drains into
+def pour_graph(down, labels, pour_cells):
+    d = down[pour_cells]
+    return np.where(d >= 0, labels[np.maximum(d, 0)], -1)
+
+
+# incremental total of a weight array (None for the cell count) per pour point: the weights of the
+# cells with each label, ignoring NaN weights
+def incremental(labels, n, weight=None):
+    sel = labels >= 0
+    if weight is None:
+        return np.bincount(labels[sel], minlength=n).astype(np.float64)
+    w = np.nan_to_num(np.asarray(weight, dtype=np.float64).ravel()[sel])
+    return np.bincount(labels[sel], weights=w, minlength=n)
+
+
+# upstream totals over the pour point network: the incremental totals of each pour point plus those of
+# every pour point upstream of it
+def network_totals(ds, increments):
+    up = flow.accumulate_down(ds, np.ones(len(ds), dtype=bool), increments)
+    return [inc + u for inc, u in zip(increments, up)]
+
+
+# label the watersheds of the points of xy, snapped to the highest flow accumulation within
+# snap_radius. Points on the same cell share a pour point; points that cannot be snapped to a cell
+# with data are not found. Returns a Watersheds tuple, or None if no point was snapped.
+def label_watersheds(in_fd, in_fa, xy, snap_radius):
+    xy = np.asarray(xy, dtype=np.float64)
+    if len(xy) == 0:
+        return None
+    grid = rT.grid_of(in_fd)
+    # the D8 codes fit in one byte, and flow.downstream only compares them
+    fdir = arcpy.RasterToNumPyArray(in_fd, rT.lower_left(grid, grid.nrows, 0), grid.ncols, grid.nrows, 0)
+    fdir = np.asarray(fdir, dtype=np.uint8)
+    down = flow.downstream(fdir)
+    del fdir
+    fa = read_grid(in_fa, grid)
+    cells = rS.argmax_in_radius(fa, grid.x_min, grid.y_max, grid.cell, xy, snap_radius)
+    del fa
+    found = cells >= 0
+    if not np.any(found):
+        return None
+    pour_cells, node = np.unique(cells[found], return_inverse=True)
+    labels = label_cells(down, pour_cells)
+    return Watersheds(grid, labels, pour_graph(down, labels, pour_cells), pour_cells, node, found)
+
+
+# upstream total at each point of the labelled watersheds ws of a weight raster (in_raster None for
+# the cell count). As in FlowAccumulation, the totals do not count the pour point cell itself.
+# Points that were not snapped get NaN.
+def point_totals(ws, in_raster=None):
+    out = np.empty(len(ws.found))
+    out[...] = np.nan
+    n = len(ws.pour_cells)
+    if in_raster is None:
+        total = network_totals(ws.ds, [incremental(ws.labels, n)])[0] - 1.0
+    else:
+        weight = read_grid(in_raster, ws.grid).ravel()
+        total = network_totals(ws.ds, [incremental(ws.labels, n, weight)])[0]
+        total -= np.nan_to_num(weight[ws.pour_cells])
+    out[ws.found] = total[ws.node]
+    return out
+
+
+# drainage area (cell count, as in FlowAccumulation) and accumulated precipitation at each point of
+# xy, from the watersheds of the points snapped to the highest flow accumulation within snap_radius
+# (see label_watersheds and point_totals). Points that cannot be snapped to a cell with data get NaN.
+def drainage(in_fd, in_fa, in_ppt, xy, snap_radius):
+    ws = label_watersheds(in_fd, in_fa, xy, snap_radius)
+    if ws is None:
+        out = np.empty(len(xy))
+        out[...] = np.nan
+        return out, out.copy()
+    return point_totals(ws), point_totals(ws, in_ppt)
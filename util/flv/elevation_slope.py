@@ -23,56 +23,65 @@ Last revision on 01 Jan. 2015
           
 '''
 # This code was slightly revised by Jesse Langdon, 1/30/2015.
+# Elevations are interpolated from the DEM with NumPy (util/drainage/raster_sample.py) rather than
+# with AddSurfaceInformation, so the 3D Analyst extension is no longer required.
 
 # Import of required libraries
 import arcpy
+import numpy as np
 from arcpy import env
 from arcpy.sa import *
-import flv_UpToDateShapeLengthField as UPD_SL
+from .. import line_array, table_array
+from ..drainage import raster_sample as rS
 
-def elev_slope(inFC, DEM, Output):
-  # creation of the output with the new fields
-  arcpy.AddMessage("Creating output with new fields...") 
+# slope metrics of lines from the elevations and coordinates of their endpoints and their lengths:
+# Slope is the drop over the straight distance between the endpoints, Slope3D the drop over the
+# length of the line. Lines with endpoints in the same place or no length get NaN (null) slopes,
+# as do lines without elevations.
+def slope_metrics(z_up, z_down, xy_up, xy_down, length):
+  drop = z_up - z_down
+  dist = np.hypot(xy_down[:, 0] - xy_up[:, 0], xy_down[:, 1] - xy_up[:, 1])
+  slope = np.empty(len(drop))
+  slope[...] = np.nan
+  slope3d = slope.copy()
+  ok = dist > 0
+  slope[ok] = drop[ok] / dist[ok]
+  ok = length > 0
+  slope3d[ok] = drop[ok] / length[ok]
+  return {"Z_Up": z_up, "Z_Down": z_down, "Slope": slope, "Slope3D": slope3d}
 
-  Out = arcpy.CopyFeatures_management(inFC, "in_memory\\OutTemp")
-  arcpy.AddField_management(Out, "Z_Up", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-  arcpy.AddField_management(Out, "Z_Down", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-  UPD_SL.UpToDateShapeLengthField(Out)
 
-  arcpy.AddMessage("Converting input line into points and adding surface information...") 
-  Pts = arcpy.FeatureVerticesToPoints_management(Out, "in_memory\\Pts", "BOTH_ENDS")
-  arcpy.AddXY_management(Pts)
-
-  # extraction and calculation of the topologic metrics
-  arcpy.AddSurfaceInformation_3d(Out, DEM, "Z_MEAN", "BILINEAR")
-  arcpy.AddSurfaceInformation_3d(Pts, DEM, "Z", "BILINEAR")
-  arcpy.AddField_management(Out, "Slope", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-  arcpy.AddField_management(Out, "Slope3D", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
+# elevation and slope metrics of lines held as vertex and offset arrays: the mean elevation along
+# every line and the elevation of the first (upstream) and last (downstream) vertex of every line,
+# interpolated with raster_sample one block of the DEM at a time, and the slopes between them
+def surface_metrics(xy, offsets, DEM):
+  arcpy.AddMessage("Adding surface information...") 
+  xy_up = line_array.first_points(xy, offsets)
+  xy_down = line_array.last_points(xy, offsets)
+  z = rS.sample_bilinear(DEM, np.concatenate((xy_up, xy_down)))
 
   arcpy.AddMessage("Calculating metrics...") 
-  rows1 = arcpy.UpdateCursor(Out)
-  rows2 = arcpy.SearchCursor(Pts)
-  rows3 = arcpy.SearchCursor(Pts)
-  line2 = rows2.next()
-  line3 = rows3.next()
-  line3 = rows3.next()
+  n = len(offsets) - 1
+  metrics = slope_metrics(z[:n], z[n:], xy_up, xy_down, line_array.line_length(xy, offsets))
+  metrics["Z_Mean"] = rS.mean_along_lines(DEM, xy, offsets)
+  return metrics
+
+
+# elev_slope for the segments of a SegmentTable (see segment_table.py): the metrics are added to the
+# table as columns
+def elev_slope_table(table, DEM):
+  table.update(surface_metrics(table.xy, table.offsets, DEM))
+  return table
 
-  for line1 in rows1 :
-      line1.Z_Up = line2.Z
-      line1.Z_Down = line3.Z
-      
-      try:
-        line1.Slope = (line1.Z_Up - line1.Z_Down) / (((line3.POINT_X-line2.POINT_X)**2 + (line3.POINT_Y-line2.POINT_Y)**2)**0.5)
-      except Exception as e:
-        print e
-        pass
-      line1.Slope3D = (line1.Z_Up - line1.Z_Down) / line1.Shape_Length
-      rows1.updateRow(line1)
-      
-      line2 = rows2.next()
-      line2 = rows2.next()
-      line3 = rows3.next()
-      line3 = rows3.next()
+
+def elev_slope(inFC, DEM, Output):
+  # creation of the output
+  arcpy.AddMessage("Creating output with new fields...") 
+  Out = arcpy.CopyFeatures_management(inFC, "in_memory\\OutTemp")
+
+  # extraction and calculation of the topologic metrics
+  xy, offsets, oids, attrs = line_array.read_lines(Out)
+  table_array.write_columns(Out, oids, surface_metrics(xy, offsets, DEM))
 
   arcpy.CopyFeatures_management(Out, Output)
 
@@ -88,6 +97,5 @@ def elev_slope(inFC, DEM, Output):
               continue
 
   arcpy.AddMessage("Deleting temporary files...")
-  arcpy.Delete_management(Pts)
   arcpy.Delete_management(Out)
   return Output
\ No newline at end of file
@@ -0,0 +1,209 @@
+# file name:	line_array.py
+# description:	Helper functions for working with polyline geometry as flat NumPy arrays rather than
+#				per-feature arcpy geometry objects.  Lines are held as one (n, 2) float64 array of vertex
+#				coordinates ("xy") and an int64 array of offsets, so that the vertices of line i are
+#				xy[offsets[i]:offsets[i + 1]].  Multipart features are read as a single run of vertices,
+#				so the gap between parts would count as an edge: input lines must be single part (the
+#				clipped stream network is split with MultipartToSinglepart, see segment.clip_network).
+#				Points are held as an (n, 2) array on their own.  The kernels below work on every line
+#				at once (lengths, first and last points, positions along the lines), and slices of
+#				lines are views of the vertex array rather than copies, so no per-feature geometry
+#				objects are created until lines are written.  line_xy and bounding_boxes are not used
+#				by the NCC Tool itself; they are kept for scripts that work with the line arrays
+#				directly.
+# author:		Jesse Langdon
+# dependencies: ESRI arcpy module, numpy
+
+import os
+import arcpy
+import numpy as np
+import table_array
+
+
+# read single part polylines into flat vertex and offset arrays. Returns the vertex coordinates, the
+# offsets, the OID of each line, and a dictionary of attribute arrays (one value per line).
+def read_lines(in_line, fields=None, where_clause=None, null_value=None):
+    fields = list(fields or [])
+    arr = arcpy.da.FeatureClassToNumPyArray(in_line, ["OID@", "SHAPE@X", "SHAPE@Y"] + fields,
+                                            where_clause=where_clause, explode_to_points=True,
+                                            null_value=null_value)
+    oid = arr["OID@"]
+    xy = np.empty((len(arr), 2), dtype=np.float64)
+    xy[:, 0] = arr["SHAPE@X"]
+    xy[:, 1] = arr["SHAPE@Y"]
+    # exploded vertices are returned grouped by feature, so a new line starts wherever the OID changes
+    starts = np.flatnonzero(np.concatenate(([True], oid[1:] != oid[:-1]))) if len(oid) else np.zeros(0, np.int64)
+    offsets = np.concatenate((starts, [len(oid)])).astype(np.int64)
+    attrs = dict((f, arr[f][starts]) for f in fields)
+    return xy, offsets, oid[starts].astype(np.int64), attrs
+
+
+# length of every edge in the vertex array, with the "edges" that bridge two lines set to zero
+def edge_lengths(xy, offsets):
+    if len(xy) < 2:
+        return np.zeros(0, dtype=np.float64)
+    step = np.hypot(np.diff(xy[:, 0]), np.diff(xy[:, 1]))
+    bridge = offsets[1:-1] - 1
+    step[bridge[(bridge >= 0) & (bridge < len(step))]] = 0.0
+    return step
+
+
+# vertices of line i, as a view of the vertex array
+def line_xy(xy, offsets, i):
+    return xy[offsets[i]:offsets[i + 1]]
+
+
+# lines start to stop - 1, as a view of the vertex array and offsets that start at 0
+def slice_lines(xy, offsets, start, stop):
+    return xy[offsets[start]:offsets[stop]], offsets[start:stop + 1] - offsets[start]
+
+
+# first vertex of each line
+def first_points(xy, offsets):
+    return xy[offsets[:-1]]
+
+
+# last vertex of each line
+def last_points(xy, offsets):
+    return xy[last_index(offsets)]
+
+
+# bounding box of each line as an (n, 4) array of x min, y min, x max and y max (NaN for lines
+# without vertices)
+def bounding_boxes(xy, offsets):
+    boxes = np.empty((len(offsets) - 1, 4))
+    boxes[...] = np.nan
+    full = np.flatnonzero(np.diff(offsets) > 0)
+    if len(full):
+        boxes[full, 0:2] = np.minimum.reduceat(xy, offsets[full], axis=0)
+        boxes[full, 2:4] = np.maximum.reduceat(xy, offsets[full], axis=0)
+    return boxes
+
+
+# running distance over all vertices of all lines. Because the bridging edges have zero length,
+# this measure never decreases, so it can be searched with np.searchsorted across every line at once.
+def global_measure(xy, offsets):
+    return np.concatenate(([0.0], np.cumsum(edge_lengths(xy, offsets))))
+
+
+# index of the last vertex of each line
+def last_index(offsets):
+    return np.maximum(offsets[1:] - 1, offsets[:-1])
+
+
+# interpolate the points at global measures g (see global_measure) on the lines line_idx
+def interpolate(xy, offsets, gcum, line_idx, g):
+    first = offsets[:-1][line_idx]
+    i = np.searchsorted(gcum, g, side="right") - 1
+    i = np.clip(i, first, np.maximum(last_index(offsets)[line_idx] - 1, first))
+    nxt = np.minimum(i + 1, len(xy) - 1)
+    step = gcum[nxt] - gcum[i]
+    t = np.where(step > 0, (g - gcum[i]) / np.where(step > 0, step, 1.0), 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    return xy[i] + t[:, np.newaxis] * (xy[nxt] - xy[i])
+
+
+# batched equivalent of Polyline.positionAlongLine: the points at the given distances along the
+# lines, for all lines in one call. values holds one distance per line, or one per entry of line_idx
+# to sample any number of positions on any of the lines. With use_percentage=True the values are
+# fractions (0 to 1) of each line's length. Distances are clamped to the ends of the line.
+def position_along_line(xy, offsets, values, use_percentage=False, line_idx=None, gcum=None):
+    if gcum is None:
+        gcum = global_measure(xy, offsets)
+    if line_idx is None:
+        line_idx = np.arange(len(offsets) - 1)
+    line_idx = np.asarray(line_idx, dtype=np.int64)
+    start = gcum[offsets[:-1]][line_idx]
+    length = gcum[last_index(offsets)][line_idx] - start
+    dist = np.asarray(values, dtype=np.float64) * np.ones(len(line_idx))
+    if use_percentage:
+        dist = dist * length
+    return interpolate(xy, offsets, gcum, line_idx, start + np.clip(dist, 0.0, length))
+
+
+# distance of every vertex from the start of its own line
+def cumulative_length(xy, offsets):
+    gcum = global_measure(xy, offsets)
+    return gcum - np.repeat(gcum[offsets[:-1]], np.diff(offsets))
+
+
+# total length of each line
+def line_length(xy, offsets):
+    gcum = global_measure(xy, offsets)
+    return gcum[last_index(offsets)] - gcum[offsets[:-1]]
+
+
+# points spaced at most spacing apart along every line: each line is split into equal intervals no
+# longer than spacing, and the midpoint of every interval is returned, so that the points weight
+# every part of the line equally. Returns the points and the index of the line of each point.
+def densify(xy, offsets, spacing):
+    gcum = global_measure(xy, offsets)
+    length = gcum[last_index(offsets)] - gcum[offsets[:-1]]
+    counts = np.maximum(np.ceil(length / spacing), 1).astype(np.int64)
+    line_idx = np.repeat(np.arange(len(counts)), counts)
+    first = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+    rank = np.arange(counts.sum()) - np.repeat(first, counts)
+    frac = (rank + 0.5) / counts[line_idx]
+    return position_along_line(xy, offsets, frac, True, line_idx, gcum), line_idx
+
+
+# reorder lines by the given permutation of line indexes
+def take_lines(xy, offsets, order):
+    counts = np.diff(offsets)[order]
+    new_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    rank = np.arange(new_offsets[-1]) - np.repeat(new_offsets[:-1], counts)
+    return xy[np.repeat(offsets[:-1][order], counts) + rank], new_offsets
+
+
+# create an empty polyline feature class with the given fields. fields is a list of (field name,
+# array) pairs, and the field types follow the array dtypes.
+def create_lines(out_line, fields, spatial_reference=None):
+    out_path, out_name = os.path.split(out_line)
+    arcpy.CreateFeatureclass_management(out_path, out_name, "POLYLINE", "", "DISABLED", "DISABLED", spatial_reference)
+    for name, values in fields:
+        arcpy.AddField_management(out_line, name, table_array.field_type(values))
+    return out_line
+
+
+# create a new polyline feature class and write the lines and their attribute fields to it
+def write_lines(out_line, xy, offsets, fields, spatial_reference=None):
+    create_lines(out_line, fields, spatial_reference)
+    with arcpy.da.InsertCursor(out_line, ["SHAPE@"] + [name for name, values in fields]) as cursor:
+        insert_lines(cursor, xy, offsets, [values for name, values in fields], spatial_reference)
+    return out_line
+
+
+# insert lines through an open insert cursor (with "SHAPE@" as the first field), returning the new OIDs
+def insert_lines(cursor, xy, offsets, columns, spatial_reference=None):
+    coords = xy.tolist()
+    off = np.asarray(offsets).tolist()
+    values = [table_array.to_list(c) for c in columns]
+    oids = []
+    for i in range(len(off) - 1):
+        part = arcpy.Array([arcpy.Point(x, y) for x, y in coords[off[i]:off[i + 1]]])
+        oids.append(cursor.insertRow([arcpy.Polyline(part, spatial_reference)] + [v[i] for v in values]))
+    return np.array(oids, dtype=np.int64)
+
+
+# create an empty point feature class with the given fields (as create_lines)
+def create_points(out_point, fields, spatial_reference=None):
+    out_path, out_name = os.path.split(out_point)
+    arcpy.CreateFeatureclass_management(out_path, out_name, "POINT", "", "DISABLED", "DISABLED", spatial_reference)
+    for name, values in fields:
+        arcpy.AddField_management(out_point, name, table_array.field_type(values))
+    return out_point
+
+
+# create a new point feature class and write the points and their attribute fields to it
+def write_points(out_point, xy, fields, spatial_reference=None):
+    create_points(out_point, fields, spatial_reference)
+    with arcpy.da.InsertCursor(out_point, ["SHAPE@XY"] + [name for name, v in fields]) as cursor:
+        insert_points(cursor, xy, [v for name, v in fields])
+    return out_point
+
+
+# insert points through an open insert cursor (with "SHAPE@XY" as the first field)
+def insert_points(cursor, xy, columns):
+    values = [table_array.to_list(c) for c in columns]
+    for i, pt in enumerate(np.asarray(xy).tolist()):
+        cursor.insertRow([tuple(pt)] + [v[i] for v in values])
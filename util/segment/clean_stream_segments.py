@@ -4,73 +4,83 @@
 #               longer, and shares a common attribute code (like a stream or OID).  This code is derived from a 
 #               function posted to gis.stackexchange.com ((username: gotanuki) on Jan. 14, 2013.
 # Revised:      January 6th, 2015
+#               Endpoint matching now uses a tolerance-based snap grid instead of a location selection, and
+#               short segments (including chains of short segments) are merged with union-find and vertex
+#               concatenation instead of Dissolve and JoinField.
 
 import os, sys, arcpy
+import numpy as np
+import topology
+from .. import line_array, table_array
 arcpy.env.overwriteOutput = True
 
-def cleanLineGeom(inLine,streamID,segID,lineClusterTolerance):
-    lyrs = []
-    inLineName = arcpy.Describe(inLine).name
-    oidFieldName = arcpy.Describe(inLine).oidFieldName
-    
-    # Add new field to store field length values (to replace the "Shape_Length" or "Shape_Leng" fields)
-    arcpy.AddField_management(inLine, "SegLen", "DOUBLE", "", "", "", "","NULLABLE", "NON_REQUIRED")
-    arcpy.CalculateField_management(inLine, "SegLen", "!shape.length@meters!", "PYTHON_9.3")
+# snapTolerance is the distance within which two endpoints are treated as the same point, and
+# carryFields lists other fields whose root (longLine) values are kept on the merged lines. The
+# cleaned lines are written to outLine. With chunk_size set, the lines are read, merged and written
+# chunk_size streamID values at a time, so that only one chunk of vertices is held in memory; lines
+# are only merged with lines of the same streamID, so the chunks give the same result.
+def cleanLineGeom(inLine,streamID,segID,lineClusterTolerance,snapTolerance=0.01,carryFields=None,
+                  outLine=r'in_memory\seg_dslv',chunk_size=None):
+    carryFields = list(carryFields or [])
+    sr = arcpy.Describe(inLine).spatialReference
+    cursor = None
+    try:
+        for where in table_array.chunk_clauses(inLine, chunk_size, streamID):
+            xy, offsets, oids, attrs = line_array.read_lines(inLine, [streamID, segID] + carryFields, where)
+            cleanXY, cleanOffsets, fields = clean_lines(xy, offsets, attrs, streamID, segID, lineClusterTolerance,
+                                                        snapTolerance, carryFields)
+            if cursor is None:
+                line_array.create_lines(outLine, fields, sr)
+                cursor = arcpy.da.InsertCursor(outLine, ["SHAPE@"] + [name for name, values in fields])
+            line_array.insert_lines(cursor, cleanXY, cleanOffsets, [values for name, values in fields], sr)
+    finally:
+        if cursor is not None:
+            del cursor
+    return outLine
 
-    # Separate short and long lines into different layers, then select all longs that touch shorts
-    shortLines = arcpy.MakeFeatureLayer_management(inLine,'shortLines',"SegLen" + ' <= '+ str(lineClusterTolerance))
-    lyrs.append(shortLines)
-    longLines = arcpy.MakeFeatureLayer_management(inLine,'longLines', "SegLen" + ' > '+str(lineClusterTolerance))
-    lyrs.append(longLines)
-    arcpy.SelectLayerByLocation_management(longLines,"BOUNDARY_TOUCHES",shortLines,'',"NEW_SELECTION")
+# merge the short lines of one set of lines (vertex and offset arrays, with the streamID, segID and
+# carryFields values in attrs). Returns the vertices and offsets of the cleaned lines and their
+# fields, as (field name, array) pairs.
+def clean_lines(xy, offsets, attrs, streamID, segID, lineClusterTolerance, snapTolerance, carryFields):
+    # Separate short and long lines
+    streams = attrs[streamID].tolist()
+    segs = attrs[segID].tolist()
+    firstPts = line_array.first_points(xy, offsets).tolist()
+    lastPts = line_array.last_points(xy, offsets).tolist()
+    isShort = (line_array.line_length(xy, offsets) <= lineClusterTolerance).tolist()
+    nLines = len(segs)
 
-    # Make a dictionary relating shortLine streamID/segID pairs to their origin- and endpoint coordinate pairs
-    shortDict = {}
-    rows = arcpy.SearchCursor(shortLines)
-    for row in rows:
-        shp = row.Shape
-        shortDict[(row.getValue(streamID),row.getValue(segID))] = [(shp.firstPoint.X,shp.firstPoint.Y),(shp.lastPoint.X,shp.lastPoint.Y)]
-    del rows
+    # Hash the origin- and endpoints of all lines into a snap grid
+    endPts = firstPts + lastPts
+    endLine = list(range(nLines)) * 2
+    grid = topology.build_grid(endPts, snapTolerance)
 
-    # Make a dictionary relating longLine origin- and endpoint coordinate pairs to segIDs
-    longDict = {}
-    rows = arcpy.SearchCursor(longLines)
-    for row in rows:
-        shp = row.Shape
-        firstCoords = (shp.firstPoint.X,shp.firstPoint.Y)
-        lastCoords = (shp.lastPoint.X,shp.lastPoint.Y)
-        longDict[firstCoords] = (row.getValue(streamID),row.getValue(segID))
-        longDict[lastCoords] = (row.getValue(streamID),row.getValue(segID))
-    del rows
+    # Join each shortLine to an adjacent line with the same streamID, preferring a longLine. Shorts
+    # that only touch other shorts are joined to them, so chains of short pieces resolve to the
+    # longLine at the end of the chain. A longLine is always kept as the root of its set.
+    isLong = [not short for short in isShort]
+    parent = list(range(nLines))
+    for i in range(nLines):
+        if not isShort[i]:
+            continue
+        target = None
+        for coords in [firstPts[i], lastPts[i]]:
+            for j in topology.query_grid(grid, endPts, coords[0], coords[1], snapTolerance):
+                k = endLine[j]
+                if k == i or streams[k] != streams[i]:
+                    continue
+                if not isShort[k] or target is None or isShort[target]:
+                    target = k
+        if target is not None:
+            topology.union(parent, i, target, isLong)
+    root = topology.roots(parent)
 
-    # Create new dictionary relating shortLine segIDs to longLine segIDs that share a point
-    dissolveDict = {}
-    # If a shortLine's coordinate pair matches an entry in longDict,
-    # and the longLine's streamID matches, add their segIDs to dissolveDict
-    for ids, coordPairs in shortDict.iteritems():
-        for coords in [coordPairs[0],coordPairs[1]]:
-            if coords in longDict.iterkeys():
-                if longDict[coords][0] == ids[0]:
-                    dissolveDict[ids[1]] = longDict[coords][1]
+    # Order the pieces of each set along the stream (by segID) and concatenate their vertices,
+    # dropping the first vertex of a piece where it repeats the last vertex of the previous piece
+    order = np.lexsort((attrs[segID], root))
+    cleanXY, cleanOffsets, setStart, firstIdx = topology.merge_lines(xy, offsets, order, root, snapTolerance)
 
-    # Give all longLines a 'dissolve' value equal to their segID
-    arcpy.AddField_management(inLine,'dissolve','LONG')
-    arcpy.SelectLayerByAttribute_management(longLines,"CLEAR_SELECTION")
-    arcpy.CalculateField_management(longLines,'dissolve','[{0}]'.format(segID),'VB')
-
-    # If shortLine in dissolveDict, give it a 'dissolve' value equal to the dissolveDict value
-    # Else give it its own segID
-    urows = arcpy.UpdateCursor(shortLines,'','',segID+';dissolve')
-    for urow in urows:
-        if dissolveDict.get(urow.getValue(segID)):
-            urow.dissolve = dissolveDict[urow.getValue(segID)]
-        else:
-            urow.dissolve = urow.getValue(segID)
-        urows.updateRow(urow)
-    del urows
-
-    arcpy.Dissolve_management(inLine, r'in_memory\seg_dslv', 'dissolve', '', 'MULTI_PART')
-    cleaned = arcpy.JoinField_management(r'in_memory\seg_dslv', 'dissolve', inLine, segID, [segID, streamID])
-    arcpy.DeleteField_management(cleaned, 'dissolve')
-
-    return cleaned
+    # Each merged line keeps the segID, streamID and carried values of the root (longLine) of its set
+    rootIdx = root[order][setStart]
+    fields = [(f, attrs[f][rootIdx]) for f in [segID, streamID] + carryFields]
+    return cleanXY, cleanOffsets, fields
@@ -1,35 +1,128 @@
 ﻿# file name:	dslv_index.py
 # description:	This function dissolves all stream segments within a stream network polyline
 #				dataset based on GNIS values.  This script was developed to provide functionality
-#				to the Upstream Catchment Delineation tool. 
+#				to the Upstream Catchment Delineation tool.  Flowlines are joined into chains from their
+#				endpoint adjacency (rather than with Dissolve, Intersect and SplitLineAtPoint): a
+#				flowline is joined to the next one downstream when both have the same index value and no
+#				other flowline of that value flows in or out at the shared node. Chains of named streams
+#				are also split where an unnamed stream joins them. The adjacency is built from the
+#				flowline endpoints only, so with chunk_size set the vertices are read and merged one
+#				chunk of chains at a time.
 # author:		Jesse Langdon
 # dependencies: ESRI arcpy module, Spatial Analyst extension
 # version:		0.2
 
 import sys, arcpy
+import numpy as np
+import topology
+from .. import line_array, table_array
 
-def main(in_strm, strm_index):
-    arcpy.AddMessage("Select stream segments with " + strm_index + " values...")
-    arcpy.MakeFeatureLayer_management(in_strm, "in_strm_lyr")
-    fields = arcpy.ListFields("in_strm_lyr")
+# Returns the split stream lines and their lineage intervals: (line OID, from distance, parent)
+# arrays with one interval per source flowline in each split line, relating each part of a dissolved
+# line to the OID of its source flowline, or to the value of parent_field of the source flowline when
+# given. snapTolerance is the distance within which two flowline endpoints are treated as the same
+# node. The split lines are written to out_split. With chunk_size set, the flowlines are read
+# chunk_size at a time and only their endpoints are kept, and the chains are merged in chunks of about
+# chunk_size flowlines, so the vertices of the whole network are never held in memory at once.
+def main(in_strm, strm_index, parent_field=None, snapTolerance=0.01, out_split=r"in_memory\strm_split",
+         chunk_size=None):
+    arcpy.AddMessage("Reading stream segments with " + strm_index + " values...")
+    fields = arcpy.ListFields(in_strm)
     for f in fields:
         if f.name == strm_index:
             f_type = f.type
     if f_type == 'Integer':
-        expr_strm_wID = strm_index + " >= 0"
-        arcpy.SelectLayerByAttribute_management("in_strm_lyr", "NEW_SELECTION", expr_strm_wID)
+        null_value = -1
     elif f_type == 'String':
-        expr_strm_wID = strm_index + " <> ''"
-        arcpy.SelectLayerByAttribute_management("in_strm_lyr", "NEW_SELECTION", expr_strm_wID)
-    strm_wID = arcpy.CopyFeatures_management("in_strm_lyr", r"in_memory\strm_wID")
+        null_value = ''
+    carry = [parent_field] if parent_field else []
+    parts = []
+    for where in table_array.chunk_clauses(in_strm, chunk_size):
+        xy, offsets, oid, attrs = line_array.read_lines(in_strm, [strm_index] + carry, where,
+                                                        null_value={strm_index: null_value})
+        parts.append((oid, line_array.first_points(xy, offsets), line_array.last_points(xy, offsets),
+                      attrs[strm_index], attrs[parent_field] if parent_field else oid))
+    oid, firstPts, lastPts, values, parent = [np.concatenate(p) for p in zip(*parts)]
+    if chunk_size is not None:
+        xy = offsets = None
+    named = (values >= 0) if f_type == 'Integer' else (values != '')
+
+    # Endpoint adjacency: the node at the start and at the end of every flowline
+    n = len(oid)
+    node = topology.point_nodes(np.concatenate((firstPts, lastPts)), snapTolerance)
+    startNode = node[:n]
+    endNode = node[n:]
+    unnamedNode = np.zeros(2 * n, dtype=bool)
+    unnamedNode[startNode[~named]] = True
+    unnamedNode[endNode[~named]] = True
+
+    # Flowlines flowing into and out of each node, per index value: a key for each (node, value)
+    uniq, code = np.unique(values, return_inverse=True)
+    inKey = endNode * len(uniq) + code
+    outKey = startNode * len(uniq) + code
+    inSorted = np.sort(inKey)
+    nIn = np.searchsorted(inSorted, inKey, side="right") - np.searchsorted(inSorted, inKey, side="left")
+    outOrder = np.argsort(outKey, kind="mergesort")
+    outSorted = outKey[outOrder]
+    lo = np.searchsorted(outSorted, inKey, side="left")
+    nOut = np.searchsorted(outSorted, inKey, side="right") - lo
 
     arcpy.AddMessage("Dissolving segments...")
-    strm_dslvID = arcpy.Dissolve_management(strm_wID, r"in_memory\strm_dslvID", strm_index, "", "SINGLE_PART", "DISSOLVE_LINES")
-    arcpy.SelectLayerByAttribute_management("in_strm_lyr", "SWITCH_SELECTION", "")
-    strm_noID = arcpy.CopyFeatures_management("in_strm_lyr", r"in_memory\strm_noid")
-    split_pnt = arcpy.Intersect_analysis([strm_dslvID, strm_noID], r"in_memory\split_pnt", "ONLY_FID", "", "point")
-    strm_split = arcpy.SplitLineAtPoint_management(strm_dslvID, split_pnt, r"in_memory\strm_split", "5 meters")
-    strm_dslvNoID = arcpy.Dissolve_management(strm_noID, r"in_memory\strm_dslvNoID", strm_index, "", "SINGLE_PART", "DISSOLVE_LINES")
-    arcpy.Append_management(strm_dslvNoID, strm_split, "no_test", "", "")
-
-    return strm_split
\ No newline at end of file
+    # a flowline links to the only flowline of its value leaving its end node, when it is also the
+    # only one of its value arriving there; named streams are split where an unnamed stream joins them
+    link = (nIn == 1) & (nOut == 1) & ~(named & unnamedNode[endNode])
+    nxt = np.arange(n, dtype=np.int64)
+    nxt[link] = outOrder[lo[link]]
+    # a link that closes a loop is left out, so that every set is a simple chain
+    nxt = topology.break_cycles(nxt)
+
+    # Order the flowlines of each chain from upstream to downstream
+    last, toLast = topology.chain_ends(nxt)
+    order = np.lexsort((-toLast, last))
+    chainStart = np.flatnonzero(np.concatenate(([True], last[order][1:] != last[order][:-1])))[:n]
+    if chunk_size is None:
+        bounds = chainStart[:1]
+    else:
+        chunk = chainStart // int(chunk_size)
+        bounds = chainStart[np.concatenate(([True], chunk[1:] != chunk[:-1]))[:len(chunk)]]
+    bounds = np.concatenate((bounds, [n])).astype(np.int64)
+
+    # Concatenate the flowlines of each chain, one chunk of whole chains at a time
+    strm_split = out_split
+    sr = arcpy.Describe(in_strm).spatialReference
+    line_array.create_lines(strm_split, [(strm_index, values)], sr)
+    lineage = [(np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=np.int64))]
+    with arcpy.da.InsertCursor(strm_split, ["SHAPE@", strm_index]) as cursor:
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            members = order[start:stop]
+            if chunk_size is None:
+                cXY, cOffsets, pos = xy, offsets, members
+            else:
+                cXY, cOffsets, pos = read_members(in_strm, oid[members])
+            group = np.zeros(len(cOffsets) - 1, dtype=np.int64)
+            group[pos] = last[members]
+            mXY, mOffsets, setStart, firstIdx = topology.merge_lines(cXY, cOffsets, pos, group, snapTolerance)
+            mOID = line_array.insert_lines(cursor, mXY, mOffsets, [values[members[setStart]]], sr)
+
+            # Lineage intervals: each flowline starts at its first vertex in the merged line
+            member = np.zeros(len(members), dtype=np.int64)
+            member[setStart] = 1
+            member = np.cumsum(member) - 1
+            dist = line_array.cumulative_length(mXY, mOffsets)
+            lineage.append((mOID[member], dist[firstIdx], parent[members].astype(np.int64)))
+
+    lineage = tuple(np.concatenate(p) for p in zip(*lineage))
+    return strm_split, lineage
+
+
+# vertices of the flowlines with the given OIDs, read in batches of OIDs, and the index of the line
+# of each OID in them
+def read_members(in_strm, oids):
+    parts = [line_array.read_lines(in_strm, where_clause=where)
+             for where in table_array.oid_clauses(in_strm, oids)]
+    xy = np.concatenate([p[0] for p in parts])
+    counts = np.concatenate([np.diff(p[1]) for p in parts])
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    found = np.concatenate([p[2] for p in parts])
+    sort = np.argsort(found, kind="mergesort")
+    return xy, offsets, sort[np.searchsorted(found[sort], oids)]
@@ -7,70 +7,52 @@
 # version:      0.2
 
 import os, sys, arcpy
-
-def plot_end(in_line, in_fields):
-	end_point = arcpy.CreateFeatureclass_management("in_memory", "end_point", "POINT", "", "DISABLED", "DISABLED", in_line)
-	arcpy.AddField_management(end_point, "LineOID", "DOUBLE")
-	arcpy.AddField_management(end_point, "Value", "DOUBLE")
-	with arcpy.da.SearchCursor(in_line, (in_fields)) as search:
-		with arcpy.da.InsertCursor(end_point, ("SHAPE@", "LineOID", "Value")) as insert:
-			for row in search:
-				try:
-					line_geom = row[0]
-					length = float(line_geom.length)
-					oid = str(row[1])
-					start = arcpy.PointGeometry(line_geom.firstPoint)
-					if in_line != "in_memory\line_dup":
-						end = arcpy.PointGeometry(line_geom.lastPoint)
-						insert.insertRow((end, oid, str(length)))
-					else:
-						prct_end = line_geom.positionAlongLine(0.85,True).firstPoint
-						insert.insertRow((prct_end, oid, str(length)))
-				except Exception as e:
-					print e.message
-	return end_point
-
-def main(line, seg_length):
+import numpy as np
+import topology
+from .. import line_array, table_array
+
+# Segments whose downstream endpoint falls within 'tolerance' of another segment's endpoint (i.e. at
+# a confluence) are given a point 85% of the way along the segment instead, so that the drainage
+# values sampled at the point belong to that segment rather than to the confluence. With chunk_size
+# set, the segments are read chunk_size at a time: a first pass collects the downstream endpoints of
+# all segments (two coordinates each), and a second pass plots the points of each chunk, so only one
+# chunk of vertices is held in memory.
+def main(line, seg_length, tolerance=0.5, chunk_size=None, out_point=r"in_memory\finalEndPnt"):
 	
 	arcpy.AddMessage("Plotting segment endpoints...")
-	arcpy.MakeFeatureLayer_management(line, "in_line_lyr")
-	fields = ["SHAPE@", "LineOID"]
-
-	# Plot endpoints for all segments
-	endPnt_all = plot_end(line, fields)
-	arcpy.MakeFeatureLayer_management(endPnt_all, "endPnt_all_lyr")
-
-	# Find duplicate endpoints
-	arcpy.FindIdentical_management("endPnt_all_lyr", "dup_table", ["Shape"], 0.5, "#", "ONLY_DUPLICATES")
-	arcpy.MakeTableView_management(r"dup_table", "dup_tblview")
-	arcpy.JoinField_management("endPnt_all_lyr","LineOID","dup_tblview","IN_FID","#")
-	arcpy.SelectLayerByAttribute_management("endPnt_all_lyr","NEW_SELECTION",""""IN_FID" IS NOT NULL""")
-	arcpy.FeatureClassToFeatureClass_conversion("endPnt_all_lyr", "in_memory", "endPnt_dup")
-
-	# Find segments with duplicate endpoints
-	arcpy.JoinField_management("in_line_lyr", "OBJECTID", "dup_tblview", "IN_FID", "#")
-	arcpy.SelectLayerByAttribute_management("in_line_lyr", "NEW_SELECTION", """"IN_FID" IS NOT NULL""")
-	arcpy.FeatureClassToFeatureClass_conversion("in_line_lyr", "in_memory", "line_dup")
-	arcpy.SelectLayerByAttribute_management("in_line_lyr", "SWITCH_SELECTION")
-	arcpy.FeatureClassToFeatureClass_conversion("in_line_lyr", "in_memory", "line_nodup")
-
-	# Re-plot endpoints for segments with duplicate endpoints
-	endPnt_dup_final = plot_end(r"in_memory\line_dup", fields)
-	arcpy.FeatureClassToFeatureClass_conversion(endPnt_dup_final, "in_memory", "endPnt_dup_final")
-	endPnt_nodup_final = plot_end(r"in_memory\line_nodup", fields)
-	arcpy.FeatureClassToFeatureClass_conversion(endPnt_nodup_final, "in_memory", "endPnt_nodup_final")
-	finalEndpnt = arcpy.Merge_management(["in_memory\endPnt_nodup_final","in_memory\endPnt_dup_final"], r"in_memory\finalEndPnt")
-
-	# clean up temp files
-	arcpy.Delete_management("in_line_lyr")
-	arcpy.Delete_management(r"dup_table")
-	arcpy.Delete_management("dup_tblview")
-	arcpy.Delete_management(endPnt_all)
-	arcpy.Delete_management("endPnt_all_lyr")
-	arcpy.Delete_management(r"in_memory\endPnt_dup")
-	arcpy.Delete_management(r"in_memory\line_dup")
-	arcpy.Delete_management(r"in_memory\line_nodup")
-	arcpy.Delete_management(r"in_memory\endPnt_nodup_final")
-	arcpy.Delete_management(r"in_memory\endPnt_dup_final")
-
-	return finalEndpnt
\ No newline at end of file
+	clauses = table_array.chunk_clauses(line, chunk_size)
+	endPts = []
+	endOids = []
+	chunk = None
+	for where in clauses:
+		chunk = line_array.read_lines(line, ["LineOID"], where)
+		endPts.extend(line_array.last_points(chunk[0], chunk[1]).tolist())
+		endOids.append(chunk[2])
+	endOids = np.concatenate(endOids)
+
+	# Find duplicate endpoints by hashing all endpoints into a snap grid
+	grid = topology.build_grid(endPts, tolerance)
+	dup = np.array([len(topology.query_grid(grid, endPts, x, y, tolerance)) > 1 for x, y in endPts], dtype=bool)
+	order = np.argsort(endOids)
+	del grid, endPts
+
+	sr = arcpy.Describe(line).spatialReference
+	fields = [("LineOID", np.zeros(0)), ("Value", np.zeros(0))]
+	line_array.create_points(out_point, fields, sr)
+	with arcpy.da.InsertCursor(out_point, ["SHAPE@XY", "LineOID", "Value"]) as cursor:
+		for where in clauses:
+			# a single chunk is still in memory from the first pass
+			if len(clauses) > 1:
+				chunk = line_array.read_lines(line, ["LineOID"], where)
+			xy, offsets, oids, attrs = chunk
+			gcum = line_array.global_measure(xy, offsets)
+			last = line_array.last_index(offsets)
+			length = gcum[last] - gcum[offsets[:-1]]
+
+			# Move the points of segments with duplicate endpoints to 85% of the segment length
+			pts = xy[last]
+			dupIdx = np.flatnonzero(dup[order[np.searchsorted(endOids[order], oids)]])
+			pts[dupIdx] = line_array.position_along_line(xy, offsets, 0.85, True, dupIdx, gcum)
+			line_array.insert_points(cursor, pts, [attrs["LineOID"].astype(np.float64), length])
+
+	return out_point
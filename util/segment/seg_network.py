@@ -23,25 +23,43 @@ arcpy.env.overwriteOutput = True
 # seg_len = arcpy.GetParameterAsText(4)
 # outFGB = arcpy.GetParameterAsText(5)
 # boolPnt = arcpy.GetParameterAsText(6)
+# chunk_size = arcpy.GetParameterAsText(7)
 
-def main(input_huc, input_strm, index_bool, strm_index, seg_len, outFGB, boolPnt):
-	# Dissolve stream segments based on index field (i.e. GNIS name)
+# With chunk_size set, the clipped network, the segments and the endpoints are kept on disk and
+# processed chunk_size lines at a time. The GNIS dissolve joins flowlines across the whole network
+# from their endpoints, then reads and merges the vertices chunk_size flowlines at a time.
+def main(input_huc, input_strm, index_bool, strm_index, seg_len, outFGB, boolPnt, chunk_size=None):
+	# Clip the stream network to the HUC, recording the source flowline of each clipped line
+	arcpy.AddMessage("Clipping the stream network to the HUC boundaries...")
+	clip_out = r"in_memory\clip_hydro" if chunk_size is None else outFGB + r"\clip_hydro"
+	strm_clip, parent_field = segment.clip_network(input_huc, input_strm, clip_out)
+
+	# Dissolve stream segments based on index field (i.e. GNIS name). The dissolved lines come with
+	# lineage intervals that relate each part of a line to its source flowline.
 	if index_bool == "true":
 		arcpy.AddMessage("Dissolving streams based on GNIS values...")
-		strm_dslv = dslv.main(input_strm, strm_index)
+		split_out = r"in_memory\strm_split" if chunk_size is None else outFGB + r"\strm_split"
+		strm_dslv, lineage = dslv.main(strm_clip, strm_index, parent_field, out_split=split_out,
+										chunk_size=chunk_size)
+		parent_field = None
 	else:
-		strm_dslv = input_strm
+		strm_dslv, lineage = strm_clip, None
 
 	# Split lines into segments
 	arcpy.AddMessage("Segmenting streams...")
-	strm_seg = segment.main(input_huc, strm_dslv, seg_len, outFGB)
-	strm_seg_id = transfer_id.main(input_strm, strm_seg, outFGB)
+	strm_seg = segment.main(None, strm_dslv, seg_len, outFGB, chunk_size, lineage, parent_field)
+	if strm_clip != input_strm:
+		arcpy.Delete_management(strm_clip)
+	strm_seg_id = transfer_id.main(input_strm, strm_seg, outFGB, chunk_size)
 	#arcpy.FeatureClassToFeatureClass_conversion(strm_seg_, outFGB, r"segments")
 
 	# Plot segment endpoints (optional)
 	if boolPnt == "true":
-		strm_pts = endpoint.main(strm_seg_id, seg_len)
-		arcpy.FeatureClassToFeatureClass_conversion(strm_pts, outFGB, "endpoints")
+		if chunk_size is None:
+			strm_pts = endpoint.main(strm_seg_id, seg_len)
+			arcpy.FeatureClassToFeatureClass_conversion(strm_pts, outFGB, "endpoints")
+		else:
+			strm_pts = endpoint.main(strm_seg_id, seg_len, chunk_size=chunk_size, out_point=outFGB + r"\endpoints")
 	else:
 		pass
 
@@ -9,27 +9,55 @@
 
 import os, sys, arcpy
 from ..flv import flv_ScratchWPathName as SWPN
-from ..flv import flv_SLEM as dS
+from ..segment import split_line as sL
 from ..segment import clean_stream_segments as cS
 
 # Derived variable from inputs
 # ScratchW = SWPN.ScratchWPathName ()
 
-def main(huc_poly, in_hydro, seg_length, outFGB):
+# clip the stream network to the HUC polygons. Intersect is used rather than Clip because it keeps
+# the OID of the source flowline of every clipped line (in its "FID_" field), which is returned as
+# the parent field of the clipped network. Flowlines that leave and re-enter the HUC come out of the
+# intersect as multipart lines, so they are split into single part lines (the line arrays read each
+# feature as one run of vertices). Without huc_poly the network is returned unclipped.
+def clip_network(huc_poly, in_hydro, out_clip):
+	if huc_poly is None:
+		return in_hydro, None
+	# dissolve multi-part HUC layers first, so that flowlines are not split at internal boundaries
+	if int(arcpy.GetCount_management(huc_poly).getOutput(0)) > 1:
+		huc_poly = arcpy.Dissolve_management(huc_poly, r"in_memory\huc_dslv")
+	clip_multi = out_clip + "_multi"
+	arcpy.Intersect_analysis([in_hydro, huc_poly], clip_multi, "ALL", "", "LINE")
+	arcpy.MultipartToSinglepart_management(clip_multi, out_clip)
+	arcpy.Delete_management(clip_multi)
+	parent_field = [f.name for f in arcpy.ListFields(out_clip) if f.name.startswith("FID_")][0]
+	return out_clip, parent_field
 
-	DeleteTF = "true"
+# chunk_size switches on the streaming mode for very large networks: the clipped network and the
+# cleaned segments are kept on disk instead of in_memory, and the lines are segmented and cleaned
+# chunk_size source lines at a time. With
+# huc_poly set to None the input network is segmented without clipping.
+# lineage (lineage intervals from dslv_index) or parent_field (a field of in_hydro) relate the
+# input lines to the source flowlines; each segment records its source flowline in "strmOID".
+# Lineage intervals only apply to unclipped input, so pass huc_poly=None with them.
+def main(huc_poly, in_hydro, seg_length, outFGB, chunk_size=None, lineage=None, parent_field=None):
 
 	# clip stream lines to huc polygon boundaries.
-	arcpy.AddMessage("Clipping the stream network to the HUC boundaries...")
-	clip_hydro = arcpy.Clip_analysis(in_hydro, huc_poly, r"in_memory\clip_hydro")
+	if huc_poly is not None:
+		arcpy.AddMessage("Clipping the stream network to the HUC boundaries...")
+		clip_out = r"in_memory\clip_hydro" if chunk_size is None else outFGB + r"\clip_hydro"
+		clip_hydro, parent_field = clip_network(huc_poly, in_hydro, clip_out)
+	else:
+		clip_hydro = in_hydro
 	
-	# segmentation of the polyline
-	arcpy.AddMessage("Using the SLEM script to segment the polyline feature...")
-	SplitLine = dS.SLEM(clip_hydro, seg_length, r"in_memory\SplitLine", DeleteTF)
-	
-	arcpy.AddMessage("Sorting the segmented line...")
+	# segmentation of the polyline (the array-based SLEM writes the segments already sorted by
+	# Rank_UGO and Distance)
+	arcpy.AddMessage("Segmenting the polyline feature...")
 	outSort = outFGB + r"\segments"
-	arcpy.Sort_management(SplitLine, outSort, [["Rank_UGO", "ASCENDING"], ["Distance", "ASCENDING"]])
+	if chunk_size is None:
+		sL.main(clip_hydro, seg_length, outSort, lineage, parent_field)
+	else:
+		sL.stream(clip_hydro, seg_length, outSort, chunk_size, lineage, parent_field)
 	
 	arcpy.AddField_management(outSort, "Rank_DGO", "LONG", "", "", "", "","NULLABLE", "NON_REQUIRED")
 	fieldname = [f.name for f in arcpy.ListFields(outSort)]
@@ -37,12 +65,15 @@ def main(huc_poly, in_hydro, seg_length, outFGB):
 
 	#delete temporary files
 	arcpy.AddMessage("Deleting temporary files...")
-	arcpy.Delete_management(SplitLine)
+	if clip_hydro != in_hydro:
+		arcpy.Delete_management(clip_hydro)
 
 	# merges adjacent stream segments if one is less than threshold.
 	arcpy.AddMessage("Cleaning line segments...")
 	clusterTolerance = float(seg_length) * 0.25
-	clean_stream = cS.cleanLineGeom(outSort, "Rank_UGO", "Rank_DGO", clusterTolerance)
+	clean_out = r"in_memory\seg_dslv" if chunk_size is None else outFGB + r"\seg_dslv"
+	clean_stream = cS.cleanLineGeom(outSort, "Rank_UGO", "Rank_DGO", clusterTolerance, carryFields=["strmOID"],
+									outLine=clean_out, chunk_size=chunk_size)
 	arcpy.AddField_management(clean_stream, "LineOID", "LONG", "", "", "", "", "NULLABLE", "NON_REQUIRED")
 	arcpy.CalculateField_management(clean_stream, "LineOID", '"!OBJECTID!"', "PYTHON_9.3")
 	arcpy.DeleteField_management(clean_stream, "Rank_UGO")
@@ -0,0 +1,177 @@
+# file name:	split_line.py
+# description:	Array-based replacement for the Fluvial Corridors SLEM (Split Line Each Meters) routine.
+#				Rather than building routes, inserting one event row per segment and creating a route
+#				event layer, every line is cut at multiples of the segment length in one batched pass
+#				over the flat vertex arrays (np.searchsorted on the cumulative line length, followed by
+#				linear interpolation of the cut points).  The output keeps the attributes written by
+#				SLEM for each of the four input types: raw polylines, UGOs ("Rank_UGO" field), sequenced
+#				UGOs ("Order_ID" field) and AGOs ("Rank_AGO" field).  Each segment also records the OID of
+#				the source flowline under its midpoint ("strmOID"), so the segments can be related to the
+#				original stream network without a spatial join.
+# author:		Jesse Langdon
+# dependencies: ESRI arcpy module, numpy
+
+import arcpy
+import numpy as np
+from .. import line_array, table_array
+import topology
+
+
+# identification of the polyline type (same order of precedence as SLEM): 0 = raw, 1 = UGO,
+# 2 = sequenced UGO, 3 = AGO
+def line_type(fieldnames):
+    if "Rank_AGO" in fieldnames:
+        return 3
+    elif "Order_ID" in fieldnames:
+        return 2
+    elif "Rank_UGO" in fieldnames:
+        return 1
+    return 0
+
+
+# cut every line into pieces of the given length, from the first vertex of the line to the last.
+# Returns the vertex and offset arrays of the pieces, the index of the source line of each piece,
+# and the from/to distance of each piece along its source line.
+def split_lines(xy, offsets, distance):
+    distance = float(distance)
+    gcum = line_array.global_measure(xy, offsets)
+    start_m = gcum[offsets[:-1]]
+    length = gcum[line_array.last_index(offsets)] - start_m
+
+    # one piece for each started multiple of the segment length (zero-length lines give no pieces)
+    n_piece = np.where(length > 0, np.ceil(length / distance), 0).astype(np.int64)
+    line_idx = np.repeat(np.arange(len(length)), n_piece)
+    rank = np.arange(len(line_idx)) - np.repeat(np.cumsum(n_piece) - n_piece, n_piece)
+    from_m = rank * distance
+    to_m = np.minimum(from_m + distance, length[line_idx])
+
+    # cut points at both ends of each piece
+    g_from = start_m[line_idx] + from_m
+    g_to = start_m[line_idx] + to_m
+    p_from = line_array.interpolate(xy, offsets, gcum, line_idx, g_from)
+    p_to = line_array.interpolate(xy, offsets, gcum, line_idx, g_to)
+
+    # original vertices that fall strictly between the two cut points of each piece
+    first = offsets[:-1][line_idx]
+    last = line_array.last_index(offsets)[line_idx]
+    lo = np.clip(np.searchsorted(gcum, g_from, side="right"), first + 1, last)
+    hi = np.clip(np.searchsorted(gcum, g_to, side="left"), first + 1, last)
+    n_inner = np.maximum(hi - lo, 0)
+
+    # assemble the pieces: start point, inner vertices, end point
+    n_vert = n_inner + 2
+    out_offsets = np.concatenate(([0], np.cumsum(n_vert))).astype(np.int64)
+    out_xy = np.empty((out_offsets[-1], 2), dtype=np.float64)
+    out_xy[out_offsets[:-1]] = p_from
+    out_xy[out_offsets[1:] - 1] = p_to
+    inner_rank = np.arange(n_inner.sum()) - np.repeat(np.cumsum(n_inner) - n_inner, n_inner)
+    out_xy[np.repeat(out_offsets[:-1] + 1, n_inner) + inner_rank] = xy[np.repeat(lo, n_inner) + inner_rank]
+
+    return out_xy, out_offsets, line_idx, from_m, to_m
+
+
+# attribute fields of the segmented output and the order in which SLEM sorts it, per polyline type.
+# parent holds the source flowline OID of each segment.
+def output_fields(k, oid, attrs, line_idx, from_m, parent):
+    if k == 0:
+        fields = [("Rank_UGO", oid[line_idx].astype(np.int32)), ("Distance", from_m)]
+        sort_fields = ["Rank_UGO", "Distance"]
+    elif k == 1:
+        fields = [("Rank_UGO", attrs["Rank_UGO"][line_idx].astype(np.int32)), ("Distance", from_m)]
+        sort_fields = ["Rank_UGO", "Distance"]
+    elif k == 2:
+        fields = [("Order_ID", attrs["Order_ID"][line_idx].astype(np.int32)),
+                  ("Rank_UGO", attrs["Rank_UGO"][line_idx].astype(np.int32)),
+                  ("Distance", from_m)]
+        sort_fields = ["Rank_UGO", "Distance"]
+    else:
+        # SLEM stores the AGO distances in a LONG field
+        fields = [("Order_ID", attrs["Order_ID"][line_idx].astype(np.int32)),
+                  ("Rank_UGO", attrs["Rank_UGO"][line_idx].astype(np.int32)),
+                  ("Rank_AGO", attrs["Rank_AGO"][line_idx].astype(np.int32)),
+                  ("AGO_Val", attrs["AGO_Val"][line_idx].astype(np.float64)),
+                  ("Distance", from_m.astype(np.int32))]
+        sort_fields = ["Order_ID", "Rank_UGO", "Rank_AGO", "Distance"]
+    return fields + [("strmOID", parent.astype(np.int32))], sort_fields
+
+
+# fields carried from the input lines to the segments, per polyline type
+def carried_fields(k):
+    return [[], ["Rank_UGO"], ["Order_ID", "Rank_UGO"], ["Order_ID", "Rank_UGO", "Rank_AGO", "AGO_Val"]][k]
+
+
+# source flowline OID of the middle of every segment. Without lineage intervals (see
+# topology.lineage_at) each line is its own source, or the value of its parent_field.
+def segment_parent(xy, offsets, oid, attrs, line_idx, from_m, to_m, lineage=None, parent_field=None):
+    default = attrs[parent_field] if parent_field else oid
+    if lineage is None:
+        return np.asarray(default)[line_idx].astype(np.int64)
+    return topology.lineage_at(lineage, oid, line_array.line_length(xy, offsets), line_idx,
+                               0.5 * (from_m + to_m), default)
+
+
+# segment one set of lines and return the segment vertices, offsets and attribute fields, sorted as
+# SLEM sorts its output
+def segment_lines(xy, offsets, oid, attrs, k, Distance, lineage=None, parent_field=None):
+    seg_xy, seg_offsets, line_idx, from_m, to_m = split_lines(xy, offsets, Distance)
+    parent = segment_parent(xy, offsets, oid, attrs, line_idx, from_m, to_m, lineage, parent_field)
+    fields, sort_fields = output_fields(k, oid, attrs, line_idx, from_m, parent)
+
+    # np.lexsort uses the last key as the primary key
+    values = dict(fields)
+    order = np.lexsort([values[f] for f in reversed(sort_fields)])
+    seg_xy, seg_offsets = line_array.take_lines(seg_xy, seg_offsets, order)
+    return seg_xy, seg_offsets, [(name, col[order]) for name, col in fields]
+
+
+# fields read from the input lines: the fields carried to the segments and the parent field, if any
+def input_fields(k, parent_field=None):
+    return carried_fields(k) + ([parent_field] if parent_field else [])
+
+
+# segment a polyline feature class every 'Distance' meters and write the sorted segments to Output.
+# lineage holds the lineage intervals of the input lines (as returned by dslv_index.main), or
+# parent_field names a field holding the source flowline OID of each input line; with neither, each
+# input line is its own source.
+def main(Line, Distance, Output, lineage=None, parent_field=None):
+    k = line_type([f.name for f in arcpy.ListFields(Line)])
+
+    arcpy.AddMessage("Reading line vertices...")
+    xy, offsets, oid, attrs = line_array.read_lines(Line, input_fields(k, parent_field))
+
+    arcpy.AddMessage("Splitting lines every " + str(Distance) + " meters...")
+    seg_xy, seg_offsets, fields = segment_lines(xy, offsets, oid, attrs, k, Distance, lineage, parent_field)
+
+    sr = arcpy.Describe(Line).spatialReference
+    return line_array.write_lines(Output, seg_xy, seg_offsets, fields, sr)
+
+
+# generator that reads and segments the input lines one chunk of (at most chunk_size) features at a
+# time, so that only one chunk of vertices is held in memory
+def iter_segments(Line, Distance, chunk_size, lineage=None, parent_field=None):
+    k = line_type([f.name for f in arcpy.ListFields(Line)])
+    for where in table_array.chunk_clauses(Line, chunk_size):
+        xy, offsets, oid, attrs = line_array.read_lines(Line, input_fields(k, parent_field), where_clause=where)
+        yield segment_lines(xy, offsets, oid, attrs, k, Distance, lineage, parent_field)
+
+
+# streaming version of main: segments are written to Output as each chunk of input lines is
+# processed, so peak memory depends on chunk_size rather than on the size of the network. The
+# segments are sorted within each chunk, and chunks are read in OID order.
+def stream(Line, Distance, Output, chunk_size=10000, lineage=None, parent_field=None):
+    k = line_type([f.name for f in arcpy.ListFields(Line)])
+    sr = arcpy.Describe(Line).spatialReference
+
+    # build the output fields from an empty set of lines to get the field names and types
+    empty = dict((f, np.zeros(0)) for f in carried_fields(k))
+    none = np.zeros(0, np.int64)
+    fields = output_fields(k, none, empty, none, np.zeros(0), none)[0]
+    line_array.create_lines(Output, fields, sr)
+
+    n = 0
+    with arcpy.da.InsertCursor(Output, ["SHAPE@"] + [name for name, values in fields]) as cursor:
+        for seg_xy, seg_offsets, seg_fields in iter_segments(Line, Distance, chunk_size, lineage, parent_field):
+            line_array.insert_lines(cursor, seg_xy, seg_offsets, [values for name, values in seg_fields], sr)
+            n += len(seg_offsets) - 1
+            arcpy.AddMessage(str(n) + " segments written...")
+    return Output
@@ -0,0 +1,209 @@
+# file name:	topology.py
+# description:	Helper functions for finding coincident line endpoints without geoprocessing tools.
+#				Points are hashed into a "snap grid" of square cells the size of the snapping tolerance,
+#				so the points within tolerance of any location are found by checking the 3 x 3 block
+#				of cells around it, regardless of how many points are in the grid.  point_nodes does
+#				the same with sorted cell keys in NumPy, for every endpoint of a network at once.
+#				lineage_at looks up which source flowline each part of a dissolved line came from, in
+#				the lineage intervals that dslv_index records while merging the flowlines.
+# author:		Jesse Langdon
+# dependencies: numpy
+
+import math
+import numpy as np
+from .. import line_array
+
+
+# integer snap grid cell (column, row) of each point
+def grid_cells(xy, tolerance):
+    return np.floor(np.asarray(xy, dtype=np.float64) / float(tolerance)).astype(np.int64)
+
+
+# build a snap grid: a dictionary relating each occupied cell to the indexes of the points in it
+def build_grid(xy, tolerance):
+    grid = {}
+    for i, cell in enumerate(grid_cells(xy, tolerance).tolist()):
+        grid.setdefault(tuple(cell), []).append(i)
+    return grid
+
+
+# indexes of the grid points within tolerance of (x, y). pts holds the coordinates the grid was
+# built from, preferably as a list of [x, y] pairs (faster to index than a NumPy array).
+def query_grid(grid, pts, x, y, tolerance):
+    tolerance = float(tolerance)
+    cx = int(math.floor(x / tolerance))
+    cy = int(math.floor(y / tolerance))
+    hits = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for i in grid.get((cx + dx, cy + dy), ()):
+                px, py = pts[i]
+                if (px - x) ** 2 + (py - y) ** 2 <= tolerance ** 2:
+                    hits.append(i)
+    return hits
+
+
+# union-find: return the root of item i, halving the path to the root as it goes
+def find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+# union-find: join the sets containing items i and j. If keep is given, a root with keep[root] set
+# stays the root of the joined set; otherwise the root of j's set does.
+def union(parent, i, j, keep=None):
+    ri = find(parent, i)
+    rj = find(parent, j)
+    if ri == rj:
+        return rj
+    if keep is not None and keep[ri] and not keep[rj]:
+        parent[rj] = ri
+        return ri
+    parent[ri] = rj
+    return rj
+
+
+# root of every item, as an array
+def roots(parent):
+    return np.array([find(parent, i) for i in range(len(parent))], dtype=np.int64)
+
+
+# node id of every point: points within tolerance of each other (directly or through other points)
+# share a node, numbered by the smallest point index in the node. The pairs of points within
+# tolerance are found from the snap grid with sorted cell keys, and the nodes by propagating the
+# smallest point index across the pairs, so no Python object is kept per point.
+def point_nodes(xy, tolerance):
+    xy = np.asarray(xy, dtype=np.float64)
+    n = len(xy)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    cells = grid_cells(xy, tolerance)
+    cells = cells - cells.min(axis=0) + 1
+    width = cells[:, 0].max() + 2
+    key = cells[:, 1] * width + cells[:, 0]
+    sort = np.argsort(key, kind="mergesort")
+    sortedKey = key[sort]
+
+    # pairs (i, j), j < i, of points within tolerance, from the 3 x 3 block of cells around each point
+    pair_i = []
+    pair_j = []
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            cellKey = key + dy * width + dx
+            lo = np.searchsorted(sortedKey, cellKey, side="left")
+            count = np.searchsorted(sortedKey, cellKey, side="right") - lo
+            i = np.repeat(np.arange(n), count)
+            rank = np.arange(len(i)) - np.repeat(np.cumsum(count) - count, count)
+            j = sort[np.repeat(lo, count) + rank]
+            step = xy[i] - xy[j]
+            near = (j < i) & ((step ** 2).sum(axis=1) <= float(tolerance) ** 2)
+            pair_i.append(i[near])
+            pair_j.append(j[near])
+    pair_i = np.concatenate(pair_i)
+    pair_j = np.concatenate(pair_j)
+
+    # every point takes the smallest node id among the points paired with it, until nothing changes
+    node = np.arange(n, dtype=np.int64)
+    while len(pair_i):
+        low = np.minimum(node[pair_i], node[pair_j])
+        target = np.concatenate((pair_i, pair_j))
+        low = np.concatenate((low, low))
+        key = np.lexsort((low, target))
+        uniq, first = np.unique(target[key], return_index=True)
+        update = np.minimum(node[uniq], low[key][first])
+        if np.all(update == node[uniq]):
+            break
+        node[uniq] = update
+        while np.any(node[node] != node):
+            node = node[node]
+    return node
+
+
+# remove one link from every cycle of "next item" links (nxt[i] = i for the last item of a chain),
+# so that every set of linked items is a simple chain. The link broken in a cycle is the one into
+# its smallest item, found by pointer jumping.
+def break_cycles(nxt):
+    nxt = np.asarray(nxt, dtype=np.int64).copy()
+    n = len(nxt)
+    jump = nxt.copy()
+    low = np.arange(n, dtype=np.int64)
+    for _ in range(int(np.ceil(np.log2(max(n, 2)))) + 1):
+        low = np.minimum(low, low[jump])
+        jump = jump[jump]
+    # after n jumps an item in a chain has reached the chain end, an item in a cycle has not
+    inCycle = nxt[jump] != jump
+    cut = inCycle & (nxt == low)
+    nxt[cut] = np.flatnonzero(cut)
+    return nxt
+
+
+# chains from "next item" links (nxt[i] = i for the last item of a chain, with no cycles): the last
+# item of every item's chain and the number of links from the item to it, found by pointer jumping
+def chain_ends(nxt):
+    nxt = np.asarray(nxt, dtype=np.int64).copy()
+    dist = (nxt != np.arange(len(nxt))).astype(np.int64)
+    while np.any(nxt[nxt] != nxt):
+        dist = dist + dist[nxt]
+        nxt = nxt[nxt]
+    return nxt, dist
+
+
+# concatenate lines into merged lines. order lists the lines in the order they are joined and group
+# holds the merged line of each line; lines of the same group must be adjacent in order. The first
+# vertex of a line is dropped where it repeats (within tolerance) the last vertex of the previous
+# line of its group. Returns the merged vertices and offsets, the position in order of the first
+# line of every merged line, and the index in the merged vertices where each line (in order) starts.
+def merge_lines(xy, offsets, order, group, tolerance):
+    if len(order) == 0:
+        none = np.zeros(0, dtype=np.int64)
+        return np.zeros((0, 2)), np.zeros(1, dtype=np.int64), none, none
+    cxy, coffsets = line_array.take_lines(xy, offsets, order)
+    g = np.asarray(group)[order]
+    newSet = np.concatenate(([True], g[1:] != g[:-1]))
+    gap = np.zeros(len(order))
+    step = cxy[coffsets[1:-1]] - cxy[line_array.last_index(coffsets)[:-1]]
+    gap[1:] = np.hypot(step[:, 0], step[:, 1])
+    dropFirst = ~newSet & (gap <= tolerance)
+    keep = np.ones(len(cxy), dtype=bool)
+    keep[coffsets[:-1][dropFirst]] = False
+    counts = np.diff(coffsets) - dropFirst
+    setStart = np.flatnonzero(newSet)
+    mOffsets = np.concatenate(([0], np.cumsum(np.add.reduceat(counts, setStart)))).astype(np.int64)
+    # a dropped first vertex is replaced by the last vertex of the previous line
+    firstIdx = np.cumsum(keep)[coffsets[:-1]] - 1
+    return cxy[keep], mOffsets, setStart, firstIdx
+
+
+# parent of the points at distances dist along the lines line_idx, looked up in the lineage
+# intervals of the lines with OIDs oid: (l_oid, l_from, l_parent) arrays giving the line OID, the
+# distance along the line where each interval starts and its parent, as returned by dslv_index.main.
+# Points on lines without intervals get default[line_idx].
+def lineage_at(lineage, oid, length, line_idx, dist, default):
+    l_oid, l_from, l_parent = lineage
+    line_idx = np.asarray(line_idx, dtype=np.int64)
+    out = np.asarray(default)[line_idx].astype(np.int64)
+    if len(oid) == 0 or len(l_oid) == 0:
+        return out
+    oid = np.asarray(oid)
+    length = np.asarray(length, dtype=np.float64)
+    order = np.argsort(oid, kind="mergesort")
+    pos = np.minimum(np.searchsorted(oid[order], l_oid), len(oid) - 1)
+    valid = oid[order][pos] == l_oid
+    l_line = order[pos[valid]]
+    l_from = np.asarray(l_from)[valid]
+    l_parent = np.asarray(l_parent)[valid]
+
+    # the intervals of all lines are placed on one measure (each line starts after the end of the
+    # previous one), so a single searchsorted finds the interval under every point
+    base = np.concatenate(([0.0], np.cumsum(length + 1.0)))
+    key = np.lexsort((l_from, l_line))
+    l_line = l_line[key]
+    l_start = base[l_line] + np.minimum(l_from[key], length[l_line])
+    l_parent = l_parent[key]
+
+    i = np.searchsorted(l_start, base[line_idx] + dist, side="right") - 1
+    found = (i >= 0) & (l_line[np.maximum(i, 0)] == line_idx) if len(l_line) else np.zeros(len(line_idx), bool)
+    out[found] = l_parent[i[found]]
+    return out
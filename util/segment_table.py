@@ -0,0 +1,130 @@
+# file name:	segment_table.py
+# description:	In-memory table of stream segments shared by the parameter calculation stages of the NCC
+#				Tool.  A SegmentTable holds the segment geometry as flat vertex and offset arrays (see
+#				line_array.py), the OID of every segment and one typed NumPy array per attribute
+#				field, all in the same segment order.  Stages read the columns they need and add their
+#				results as new columns, and the table is written to a feature class once at the end,
+#				instead of every stage copying and rewriting a feature class.
+# author:		Jesse Langdon
+# dependencies: ESRI arcpy module, numpy
+
+import arcpy
+import numpy as np
+import line_array
+
+# value read in place of null for each field type. Integer and text nulls are also recorded in a
+# null mask per column (see SegmentTable.read), so that they are written back as null
+NULL_VALUES = {"Double": np.nan, "Single": np.nan, "Integer": np.iinfo(np.int32).min,
+               "SmallInteger": np.iinfo(np.int16).min, "String": ""}
+
+
+class SegmentTable(object):
+    # xy and offsets hold the segment vertices, oids the OID of every segment and columns a
+    # dictionary of field name to array (one value per segment). null_masks relates a column name to
+    # a boolean array set where the value is null, for columns without NaN to mark nulls
+    def __init__(self, xy, offsets, oids, columns=None, spatial_reference=None):
+        self.xy = xy
+        self.offsets = offsets
+        self.oids = oids
+        self.spatial_reference = spatial_reference
+        self.columns = {}
+        self.null_masks = {}
+        self.names = []
+        for name, values in (columns or {}).items():
+            self[name] = values
+
+    # read a polyline feature class. fields defaults to every editable number and text field;
+    # nulls are read as NaN, or as the NULL_VALUES sentinel with a null mask for integer and text fields
+    @classmethod
+    def read(cls, in_line, fields=None):
+        types = dict((f.name, f.type) for f in arcpy.ListFields(in_line))
+        if fields is None:
+            fields = [f.name for f in arcpy.ListFields(in_line)
+                      if f.editable and f.type in NULL_VALUES and not f.name.lower().startswith("shape_")]
+        null_value = dict((name, NULL_VALUES[types[name]]) for name in fields if types.get(name) in NULL_VALUES)
+        xy, offsets, oids, attrs = line_array.read_lines(in_line, fields, null_value=null_value)
+        table = cls(xy, offsets, oids, spatial_reference=arcpy.Describe(in_line).spatialReference)
+        for name in fields:
+            table[name] = attrs[name]
+            if attrs[name].dtype.kind != "f" and name in null_value:
+                mask = attrs[name] == null_value[name]
+                if np.any(mask):
+                    table.null_masks[name] = mask
+        return table
+
+    def __len__(self):
+        return len(self.oids)
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    # add or replace a column; new columns are written after the existing ones. A replaced column
+    # loses its null mask
+    def __setitem__(self, name, values):
+        values = np.asarray(values)
+        if len(values) != len(self.oids):
+            raise ValueError("column " + name + " has " + str(len(values)) + " values for " +
+                             str(len(self.oids)) + " segments")
+        if name not in self.columns:
+            self.names.append(name)
+        self.columns[name] = values
+        self.null_masks.pop(name, None)
+
+    # add or replace several columns from a dictionary of field name to array
+    def update(self, columns):
+        for name in sorted(columns):
+            self[name] = columns[name]
+
+    # set columns from values keyed on a column of integer keys (as table_array.transfer): the
+    # segments whose key_field value matches an entry of keys get the corresponding values, and the
+    # others keep their value (and stay null if they were), or get NaN (or None for object arrays) in
+    # a new column
+    def transfer(self, key_field, keys, columns):
+        keys = np.asarray(keys)
+        order = np.argsort(keys, kind="mergesort")
+        seg_keys = np.asarray(self[key_field])
+        if len(keys):
+            pos = np.minimum(np.searchsorted(keys[order], seg_keys), len(keys) - 1)
+            found = keys[order][pos] == seg_keys
+            src = order[pos][found]
+        else:
+            found = np.zeros(len(self), dtype=bool)
+            src = np.zeros(0, dtype=np.int64)
+        for name in sorted(columns):
+            values = np.asarray(columns[name])
+            if name in self.columns:
+                out = self[name].copy()
+            else:
+                out = np.empty(len(self), dtype=values.dtype if values.dtype.kind in "fO" else np.float64)
+                out[...] = None if out.dtype.kind == "O" else np.nan
+            out[found] = values[src]
+            mask = self.null_masks.get(name)
+            self[name] = out
+            if mask is not None:
+                self.null_masks[name] = mask & ~found
+
+    # segment lengths
+    def lengths(self):
+        return line_array.line_length(self.xy, self.offsets)
+
+    # column values for a cursor: the column, or an object array with None where the null mask is set
+    def cursor_values(self, name):
+        mask = self.null_masks.get(name)
+        if mask is None:
+            return self[name]
+        values = self[name].astype(object)
+        values[mask] = None
+        return values
+
+    # write the segments and their columns (all of them, or the given field names) to a new polyline
+    # feature class, with NaN and masked values written as null
+    def write(self, out_line, fields=None):
+        fields = self.names if fields is None else fields
+        line_array.create_lines(out_line, [(name, self[name]) for name in fields], self.spatial_reference)
+        with arcpy.da.InsertCursor(out_line, ["SHAPE@"] + list(fields)) as cursor:
+            line_array.insert_lines(cursor, self.xy, self.offsets, [self.cursor_values(name) for name in fields],
+                                    self.spatial_reference)
+        return out_line
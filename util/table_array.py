@@ -0,0 +1,100 @@
+# file name:	table_array.py
+# description:	Helper functions for moving attribute values between ArcGIS tables and NumPy arrays.
+#				These are shared by the array-based segmentation and parameter calculation steps of
+#				the NCC Tool, so that field values can be read and written in bulk rather than through
+#				one geoprocessing tool call per field.
+# author:		Jesse Langdon
+# dependencies: ESRI arcpy module, numpy
+
+import arcpy
+import numpy as np
+
+
+# return the ArcGIS field type that matches the dtype of an array
+def field_type(values):
+    kind = np.asarray(values).dtype.kind
+    if kind in "iub":
+        return "LONG"
+    elif kind == "f":
+        return "DOUBLE"
+    else:
+        return "TEXT"
+
+
+# convert an array to a list of python values for a cursor, with NaN written as a null value
+def to_list(values):
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        return [None if v != v else v for v in values.tolist()]
+    return values.tolist()
+
+
+# read fields of a table into a dictionary of arrays (in cursor order), with the OIDs under "OID@"
+def read_columns(in_table, fields, where_clause=None, null_value=None):
+    arr = arcpy.da.TableToNumPyArray(in_table, ["OID@"] + list(fields), where_clause=where_clause,
+                                     null_value=null_value)
+    return dict((name, arr[name]) for name in arr.dtype.names)
+
+
+# write arrays back to existing fields in one update cursor pass; rows are matched on their OID
+def write_columns(in_table, oids, columns, where_clause=None):
+    transfer(in_table, "OID@", oids, columns, where_clause)
+
+
+# add a field for each array that the table does not have yet, with the type of the array
+def add_fields(in_table, columns):
+    existing = set(f.name.lower() for f in arcpy.ListFields(in_table))
+    for name in columns:
+        if name.lower() not in existing:
+            arcpy.AddField_management(in_table, name, field_type(columns[name]))
+
+
+# attribute transfer keyed on an integer field (in place of a join and field calculation): the
+# values of every array in columns (a dictionary of field name to array) are written to the rows
+# whose key_field value matches the corresponding entry of keys, in one update cursor pass. Missing
+# fields are added first; rows without a matching key are left unchanged. where_clause limits the
+# pass to part of the table (e.g. one chunk, see chunk_clauses).
+def transfer(in_table, key_field, keys, columns, where_clause=None):
+    add_fields(in_table, columns)
+    names = list(columns.keys())
+    values = [to_list(columns[name]) for name in names]
+    index = dict(zip(np.asarray(keys).tolist(), range(len(keys))))
+    with arcpy.da.UpdateCursor(in_table, [key_field] + names, where_clause) as cursor:
+        for row in cursor:
+            i = index.get(row[0])
+            if i is not None:
+                cursor.updateRow([row[0]] + [v[i] for v in values])
+
+
+
+# where clauses that select the rows of a table in chunks of chunk_size distinct values of field (the
+# OID by default), in increasing order of the values, so that a table can be processed one chunk at
+# a time. Only the values of the field are read for this. With chunk_size None (or an empty table),
+# a single None clause selects the whole table.
+def chunk_clauses(in_table, chunk_size, field=None):
+    if chunk_size is None:
+        return [None]
+    if field is None:
+        field = arcpy.Describe(in_table).OIDFieldName
+        values = arcpy.da.TableToNumPyArray(in_table, ["OID@"])["OID@"]
+    else:
+        values = arcpy.da.TableToNumPyArray(in_table, [field])[field]
+    values = np.unique(values)
+    name = arcpy.AddFieldDelimiters(in_table, field)
+    clauses = []
+    for first in range(0, len(values), int(chunk_size)):
+        last = min(first + int(chunk_size), len(values)) - 1
+        clauses.append("{0} >= {1} AND {0} <= {2}".format(name, values[first], values[last]))
+    return clauses or [None]
+
+
+# where clauses that select the rows with the given OIDs, at most batch_size OIDs per clause (to keep
+# each clause short enough for the database), in increasing order of OID
+def oid_clauses(in_table, oids, batch_size=1000):
+    oids = np.unique(np.asarray(oids, dtype=np.int64))
+    name = arcpy.AddFieldDelimiters(in_table, arcpy.Describe(in_table).OIDFieldName)
+    clauses = []
+    for first in range(0, len(oids), batch_size):
+        ids = ",".join(str(v) for v in oids[first:first + batch_size].tolist())
+        clauses.append("{0} IN ({1})".format(name, ids))
+    return clauses